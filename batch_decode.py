@@ -0,0 +1,54 @@
+import io
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import frame_reader as fr
+
+CHUNK_OCTETS = 4 * 1024 * 1024  # approx. size of the part of a capture decoded by one worker task
+
+def split_chunks(path, chunk_octets=CHUNK_OCTETS):
+    # split a capture into (start, stop) octet ranges that begin and end on line boundaries
+    size = os.path.getsize(path)
+    chunks = []
+    with open(path, "rb") as capture:
+        start = 0
+        while start < size:
+            stop = start + chunk_octets
+            if stop < size:
+                capture.seek(stop)
+                capture.readline()  # move to the end of the line cut in two
+                stop = capture.tell()
+            else:
+                stop = size
+            chunks.append((start, stop))
+            start = stop
+    return chunks
+
+def decode_chunk(path, start, stop):
+    # decode the frames of one chunk into records (runs in a worker process)
+    with open(path, "rb") as capture:
+        capture.seek(start)
+        data = capture.read(stop - start)
+    records = []
+    for frame in fr.iter_frames(io.BytesIO(data)):
+        try:
+            records.append(frame.to_record())
+        except OSError:
+            raise
+        except Exception:  # a frame that fails to decode is skipped, as frame_output.write_frame does
+            continue
+    return records
+
+def decode_file(path, max_workers=None, chunk_octets=CHUNK_OCTETS):
+    # decode a capture across worker processes, yielding each frame record (FrameData.to_record) in file order
+    workers = max_workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(workers) as executor:
+        pending = deque()  # chunks being decoded, oldest first
+        for start, stop in split_chunks(path, chunk_octets):
+            pending.append(executor.submit(decode_chunk, path, start, stop))
+            # keep a bounded number of chunks in flight, so a slow consumer does not buffer the whole capture
+            if len(pending) >= 2*workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
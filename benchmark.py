@@ -0,0 +1,201 @@
+import argparse
+import io
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import frame_data as fd
+import frame_generator as fg
+import frame_output as fo
+import frame_reader as fr
+import message_payload as mp
+
+# Decoder benchmarks on synthetic frames (see frame_generator), results can be saved as JSON and compared across versions
+
+class NullStream:
+    # output stream of the CLI benchmark, discards what the writer produces
+    def write(self, data):
+        return len(data)
+
+# decoding steps benchmarked on each frame, name -> function of the raw frame
+def decode_frame(raw):
+    # what most consumers read: the source address and the messages
+    frame = fd.FrameData(raw)
+    frame.macHeader.srcAddr
+    frame.payload.messages
+    return frame
+
+def decode_record(raw):
+    # every field, without the text
+    frame = fd.FrameData(raw)
+    frame.to_record()
+    return frame
+
+def decode_breakdown(raw):
+    frame = fd.FrameData(raw)
+    frame.data_breakdown(0)
+    return frame
+
+FRAME_BENCHMARKS = {"frame_data": decode_frame, "to_record": decode_record, "data_breakdown": decode_breakdown}
+
+def decode_message(msgType):
+    def decode(raw):
+        message = msgType(raw)
+        message.data_breakdown(0)
+        return message
+    return decode
+
+def percentiles(latencies):
+    # latencies in ns -> percentiles in us
+    latencies = sorted(latencies)
+    last = len(latencies) - 1
+    return {name: latencies[round(last*fraction)] / 1000 for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1))}
+
+def measure_rate(items, decode, repeat):
+    # best throughput of repeat passes, with no per-item timing in the loop
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        for raw in items:
+            decode(raw)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(items) / best
+
+def measure_latency(items, decode):
+    latencies = []
+    clock = time.perf_counter_ns
+    for raw in items:
+        start = clock()
+        decode(raw)
+        latencies.append(clock() - start)
+    return percentiles(latencies)
+
+def measure_memory(items, decode):
+    # bytes kept alive by each decoded item (all of them are held until measured), and peak bytes while decoding
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    kept = [decode(raw) for raw in items]
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"keptBytesPerFrame": round((size - start) / len(kept)), "peakBytesPerFrame": round((peak - start) / len(kept))}
+
+def run_benchmark(items, decode, repeat):
+    result = {"framesPerSec": round(measure_rate(items, decode, repeat)), "latencyUs": measure_latency(items, decode)}
+    result.update(measure_memory(items, decode))
+    return result
+
+def run_cli(frames, output_format, repeat):
+    # the uwb-sniffer.py path: lines of hex read from a capture, decoded and written out
+    capture = b"".join(raw.hex().encode() + b"\n" for raw in frames)
+    best = None
+    latencies = []
+    clock = time.perf_counter_ns
+    for i in range(repeat):
+        output = fo.WRITERS[output_format](NullStream())
+        latencies = []
+        start = time.perf_counter()
+        frames_iter = fr.iter_frames(io.BytesIO(capture))
+        while True:
+            frame_start = clock()
+            frame = next(frames_iter, None)
+            if frame is None:
+                break
+            output.write(frame)
+            latencies.append(clock() - frame_start)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    output = fo.WRITERS[output_format](NullStream())
+    for frame in fr.iter_frames(io.BytesIO(capture)):
+        output.write(frame)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    # the rate includes the per-frame timing, which is small next to decoding and writing a frame
+    return {"framesPerSec": round(len(frames) / best), "latencyUs": percentiles(latencies),
+            "peakBytesPerFrame": round(peak / len(frames))}
+
+def check_positions(frames):
+    # position_batch must give the coordinates FrameData gives, its fallback included (frames with other messages)
+    try:
+        import position_batch as pb
+    except ImportError:  # numpy not installed
+        return
+    positions, group_polls = pb.decode_positions(frames)
+    expected_positions = []
+    expected_group_polls = []
+    for i, raw in enumerate(frames):
+        frame = fd.FrameData(raw)
+        for msg in frame.payload.messages:
+            if isinstance(msg, (mp.MsgPosition, mp.MsgGroupPoll)) and len(msg.raw) == msg.LENGTH:
+                rows = expected_positions if isinstance(msg, mp.MsgPosition) else expected_group_polls
+                rows.append((i, int(frame.macHeader.srcAddr.get_data(), 16), msg.x.value, msg.y.value, msg.z.value))
+    for name, decoded, expected in (("positions", positions, expected_positions), ("group polls", group_polls, expected_group_polls)):
+        rows = [(int(row["frameIndex"]), int(row["srcAddr"]), float(row["x"]), float(row["y"]), float(row["z"])) for row in decoded]
+        if rows != expected:
+            raise AssertionError("position_batch: {0} {1} decoded, {2} expected".format(len(rows), name, len(expected)))
+
+def run_suite(num_frames, seed, repeat, output_format, mixes):
+    results = {}
+    for mix in mixes:
+        frames = fg.generate_frames(mix, num_frames, seed)
+        check_positions(frames)
+        results[mix] = {name: run_benchmark(frames, decode, repeat) for name, decode in FRAME_BENCHMARKS.items()}
+        results[mix]["cli"] = run_cli(frames, output_format, repeat)
+    # each message class on its own, including the ones the payload walk does not decode (yet)
+    results["messages"] = {}
+    for msgType in fg.MESSAGE_GENERATORS:
+        messages = fg.generate_messages(msgType, num_frames, seed)
+        results["messages"][msgType.__name__] = run_benchmark(messages, decode_message(msgType), repeat)
+    return results
+
+def print_results(results, baseline=None):
+    print("{0:<38} {1:>12} {2:>9} {3:>9} {4:>9}".format("benchmark", "frames/s", "p50 us", "p99 us", "kept B"))
+    for group, benchmarks in results.items():
+        for name, result in benchmarks.items():
+            line = "{0:<38} {1:>12} {2:>9.2f} {3:>9.2f} {4:>9}".format(group + "/" + name, result["framesPerSec"],
+                result["latencyUs"]["p50"], result["latencyUs"]["p99"], result.get("keptBytesPerFrame", "-"))
+            if baseline is not None:
+                old = baseline.get(group, {}).get(name)
+                if old is not None:
+                    line += "  x{0:.2f}".format(result["framesPerSec"] / old["framesPerSec"])  # speedup over the baseline
+            print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the decoder on synthetic DWM1001 frames.")
+    parser.add_argument('-n', '--num-frames', type=int, default=2000,
+                        help='No. frames (and messages) generated per benchmark (default is 2000).')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='No. passes per benchmark, the fastest one is reported (default is 3).')
+    parser.add_argument('-s', '--seed', type=int, default=0,
+                        help='Seed of the frame generator (default is 0).')
+    parser.add_argument('-m', '--mix', action='append', choices=sorted(fg.MIXES),
+                        help='Frame mix to benchmark, repeat for several (default is all of them).')
+    parser.add_argument('-f', '--format', choices=sorted(fo.WRITERS), default='text',
+                        help='Output format of the CLI benchmark (default is text).')
+    parser.add_argument('-o', '--output', metavar='FILE',
+                        help='Save the results as JSON.')
+    parser.add_argument('--label',
+                        help='Label saved with the results, e.g. the version benchmarked.')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='JSON results of an earlier run, the speedup over it is printed.')
+    options = parser.parse_args()
+
+    results = run_suite(options.num_frames, options.seed, options.repeat, options.format, options.mix or list(fg.MIXES))
+    baseline = None
+    if options.compare != None:
+        with open(options.compare) as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+
+    if options.output != None:
+        report = {"label": options.label, "python": sys.version.split()[0], "platform": platform.platform(),
+                  "numFrames": options.num_frames, "repeat": options.repeat, "seed": options.seed,
+                  "format": options.format, "results": results}
+        with open(options.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,365 @@
+import heapq
+import mmap
+import os
+import struct
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+
+import frame_data as fd
+import frame_filter as ff
+import frame_reader as fr
+import metrics
+
+# Binary capture of raw frames, with a sidecar index for lookups by receive time and source address
+# Capture (.uwbcap): MAGIC, then one record per frame: receive time (float64 s since the epoch),
+# source ID (uint16), frame length (uint16), raw frame (FCS included). A source is named once, by a
+# record with the ID SOURCE_RECORD holding its name (UTF-8), which gets the next ID.
+# Index (capture path + ".idx"): INDEX_MAGIC, INDEX_HEADER (no. records, no. address entries, capture size,
+# size of the source names), the source names ("\n" separated, padded to 8 octets), then 4 arrays:
+# receive times (float64) and record offsets (uint64) sorted by time, source addresses (uint64) and
+# record offsets (uint64) sorted by address.
+# The reader maps both files, looks the records up in the index and only decodes those.
+
+MAGIC = b"UWBCAP1\n"
+INDEX_MAGIC = b"UWBIDX1\n"
+RECORD = struct.Struct("<dHH")  # receive time, source ID, frame length
+INDEX_HEADER = struct.Struct("<QQQQ")
+SOURCE_RECORD = 0xffff  # source ID of a record naming the next source
+NO_SOURCE = 0xfffe  # source ID of frames without a source
+MAX_SOURCES = NO_SOURCE
+
+def index_path(path):
+    return path + ".idx"
+
+def spill_path(path):
+    # sorted runs of index entries, while the index of a long capture is built
+    return path + ".idx.runs"
+
+def is_capture(path):
+    # whether a file is a binary capture (and not a text capture of the sniffer output)
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+RUN_SIZE = 1 << 18  # max. no. index entries held in memory, sorted and spilled to disk as a run when full
+MERGE_BLOCK = 1024  # no. entries of each run read at a time when merging the runs
+
+def sorted_run(keys, values, key):
+    # keys and values sorted by key (an index into them), only ever RUN_SIZE entries
+    order = sorted(range(len(keys)), key=key)
+    return array(keys.typecode, map(keys.__getitem__, order)), array("Q", map(values.__getitem__, order))
+
+def iter_run(f, start, count, typecode):
+    # (key, offset) pairs of a run stored from start as count keys then count offsets, read MERGE_BLOCK at a time
+    for i in range(0, count, MERGE_BLOCK):
+        n = min(MERGE_BLOCK, count - i)
+        keys = array(typecode)
+        offsets = array("Q")
+        f.seek(start + 8*i)
+        keys.fromfile(f, n)
+        f.seek(start + 8*(count + i))
+        offsets.fromfile(f, n)
+        yield from zip(keys, offsets)
+
+def write_pairs(f, start, count, typecode, pairs):
+    # write (key, offset) pairs from start as count keys then count offsets, MERGE_BLOCK at a time
+    written = 0
+    keys = array(typecode)
+    offsets = array("Q")
+    for key, offset in pairs:
+        keys.append(key)
+        offsets.append(offset)
+        if len(keys) == MERGE_BLOCK:
+            f.seek(start + 8*written)
+            keys.tofile(f)
+            f.seek(start + 8*(count + written))
+            offsets.tofile(f)
+            written += len(keys)
+            keys = array(typecode)
+            offsets = array("Q")
+    if keys:
+        f.seek(start + 8*written)
+        keys.tofile(f)
+        f.seek(start + 8*(count + written))
+        offsets.tofile(f)
+
+class IndexBuilder:
+    # entries of the index of a capture, written out with write()
+    # up to RUN_SIZE entries are kept in memory: beyond that, they are sorted and appended to a spill file as a run,
+    # and the runs are merged by write(), so a capture of any length is indexed in bounded memory
+    def __init__(self, spill_path):
+        self.spillPath = spill_path
+        self.spill = None  # opened with the first run
+        self.runs = []  # (position in the spill file, no. records, no. address entries) of each run
+        self.numRecords = 0
+        self.numAddresses = 0
+        self.sources = []  # names, by source ID
+        self.new_run()
+
+    def new_run(self):
+        self.times = array("d")
+        self.offsets = array("Q")
+        self.addresses = array("Q")  # source address of the frames that have one
+        self.addressOffsets = array("Q")
+
+    def add(self, offset, timestamp, raw):
+        self.times.append(timestamp)
+        self.offsets.append(offset)
+        address = ff.source_address(raw)
+        if address is not None:
+            self.addresses.append(address)
+            self.addressOffsets.append(offset)
+        if len(self.times) == RUN_SIZE:
+            self.spill_run()
+
+    def sorted_entries(self):
+        # records are appended in receive order, which is nearly sorted by time (several sniffers can interleave);
+        # entries with the same key stay in file order
+        return (sorted_run(self.times, self.offsets, self.times.__getitem__),
+                sorted_run(self.addresses, self.addressOffsets, self.addresses.__getitem__))
+
+    def spill_run(self):
+        if self.spill is None:
+            self.spill = open(self.spillPath, "w+b")
+        (times, offsets), (addresses, addressOffsets) = self.sorted_entries()
+        self.spill.seek(0, os.SEEK_END)
+        self.runs.append((self.spill.tell(), len(times), len(addresses)))
+        for entries in (times, offsets, addresses, addressOffsets):
+            entries.tofile(self.spill)
+        self.numRecords += len(times)
+        self.numAddresses += len(addresses)
+        self.new_run()
+
+    def write(self, path, capture_size):
+        num_records = self.numRecords + len(self.times)
+        num_addresses = self.numAddresses + len(self.addresses)
+        sources = "\n".join(self.sources).encode()
+        sources += bytes(-len(sources) % 8)  # keep the arrays aligned
+        with open(path, "wb") as f:
+            f.write(INDEX_MAGIC)
+            f.write(INDEX_HEADER.pack(num_records, num_addresses, capture_size, len(sources)))
+            f.write(sources)
+            if not self.runs:  # every entry is still in memory
+                for pair in self.sorted_entries():
+                    for entries in pair:
+                        entries.tofile(f)
+                return
+            if self.times:
+                self.spill_run()
+            # merge the runs, (key, offset) pairs: the offset orders the entries with the same key in file order
+            start = f.tell()
+            spill = self.spill
+            write_pairs(f, start, num_records, "d", heapq.merge(
+                *(iter_run(spill, position, count, "d") for position, count, num_run_addresses in self.runs)))
+            write_pairs(f, start + 16*num_records, num_addresses, "Q", heapq.merge(
+                *(iter_run(spill, position + 16*count, num_run_addresses, "Q") for position, count, num_run_addresses in self.runs)))
+        self.close()
+
+    def close(self):
+        # remove the spill file, e.g. once the index is written
+        if self.spill is not None:
+            self.spill.close()
+            self.spill = None
+            os.remove(self.spillPath)
+
+class CaptureWriter:
+    # appends frames to a capture, the index is written on close()
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "wb")
+        self.file.write(MAGIC)
+        self.offset = len(MAGIC)
+        self.sourceIds = {}  # source name -> ID
+        self.index = IndexBuilder(spill_path(path))
+
+    def source_id(self, source):
+        if source is None:
+            return NO_SOURCE
+        source_id = self.sourceIds.get(source)
+        if source_id is None:
+            if len(self.sourceIds) == MAX_SOURCES:
+                raise ValueError("too many sources in one capture")
+            name = str(source).encode()
+            self.file.write(RECORD.pack(0, SOURCE_RECORD, len(name)) + name)
+            self.offset += RECORD.size + len(name)
+            source_id = self.sourceIds[source] = len(self.sourceIds)
+            self.index.sources.append(str(source))
+        return source_id
+
+    def write(self, raw, source=None, timestamp=None):
+        # raw frame (bytes/memoryview, FCS included), its source and receive time (time.time() if not given)
+        timestamp = time.time() if timestamp is None else timestamp
+        source_id = self.source_id(source)
+        self.index.add(self.offset, timestamp, raw)
+        self.file.write(RECORD.pack(timestamp, source_id, len(raw)))
+        self.file.write(raw)
+        self.offset += RECORD.size + len(raw)
+
+    def close(self):
+        self.file.close()
+        self.index.write(index_path(self.path), self.offset)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def build_index(path):
+    # (re)build the index of a capture by scanning it, e.g. when the writer did not get to close it
+    # a record cut off at the end of the capture is left out
+    index = IndexBuilder(spill_path(path))
+    with open(path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        if data[:len(MAGIC)] != MAGIC:
+            raise ValueError("{} is not a binary capture".format(path))
+        offset = len(MAGIC)
+        size = len(data)
+        while offset + RECORD.size <= size:
+            timestamp, source_id, length = RECORD.unpack_from(data, offset)
+            start = offset + RECORD.size
+            if start + length > size:
+                break
+            if source_id == SOURCE_RECORD:
+                index.sources.append(data[start:start+length].decode())
+            else:
+                index.add(offset, timestamp, data[start:start+length])
+            offset = start + length
+    finally:
+        data.close()
+    index.write(index_path(path), offset)
+
+class CaptureReader:
+    # random access to the records of a capture, through its index (built first if missing or out of date)
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(MAGIC)] != MAGIC:
+            self.data.close()
+            raise ValueError("{} is not a binary capture".format(path))
+        if not os.path.exists(index_path(path)) or self.index_size() != len(self.data):
+            build_index(path)
+        with open(index_path(path), "rb") as f:
+            self.indexData = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        num_records, num_addresses, capture_size, sources_length = INDEX_HEADER.unpack_from(self.indexData, len(INDEX_MAGIC))
+        start = len(INDEX_MAGIC) + INDEX_HEADER.size
+        sources = bytes(self.indexData[start:start+sources_length]).rstrip(b"\0").decode()
+        self.sources = sources.split("\n") if sources else []
+        # the index arrays are read in place, from the mapped file
+        view = memoryview(self.indexData)
+        start += sources_length
+        self.views = []
+        self.times = self.array_view(view, start, num_records, "d")
+        self.offsets = self.array_view(view, start + 8*num_records, num_records, "Q")
+        start += 16*num_records
+        self.addresses = self.array_view(view, start, num_addresses, "Q")
+        self.addressOffsets = self.array_view(view, start + 8*num_addresses, num_addresses, "Q")
+        view.release()
+
+    def index_size(self):
+        # capture size recorded in the index, None if it is not an index
+        with open(index_path(self.path), "rb") as f:
+            header = f.read(len(INDEX_MAGIC) + INDEX_HEADER.size)
+        if header[:len(INDEX_MAGIC)] != INDEX_MAGIC or len(header) < len(INDEX_MAGIC) + INDEX_HEADER.size:
+            return None
+        return INDEX_HEADER.unpack_from(header, len(INDEX_MAGIC))[2]
+
+    def array_view(self, view, start, length, typecode):
+        array_view = view[start:start + 8*length].cast(typecode)
+        self.views.append(array_view)
+        return array_view
+
+    def __len__(self):
+        return len(self.times)
+
+    def record(self, offset):
+        # (receive time, source, raw frame) of the record at an offset
+        timestamp, source_id, length = RECORD.unpack_from(self.data, offset)
+        start = offset + RECORD.size
+        source = None if source_id == NO_SOURCE else self.sources[source_id]
+        return timestamp, source, self.data[start:start+length]
+
+    def select(self, start=None, stop=None, src_addrs=None):
+        # offsets of the records received from start to stop (s since the epoch, stop excluded, None for no limit)
+        # from any of the source addresses (ints or hex strings, None for all), in receive order
+        if src_addrs is None:
+            lo = 0 if start is None else bisect_left(self.times, start)
+            hi = len(self.times) if stop is None else bisect_left(self.times, stop)
+            return self.offsets[lo:hi].tolist()
+        # per address, the records are in file order: merge them, then check the time of each one
+        runs = []
+        for address in sorted(ff.to_set(src_addrs)):
+            lo = bisect_left(self.addresses, address)
+            hi = bisect_right(self.addresses, address, lo)
+            if lo < hi:
+                runs.append(self.addressOffsets[lo:hi].tolist())
+        offsets = list(heapq.merge(*runs))
+        if start is not None or stop is not None:
+            start = float("-inf") if start is None else start
+            stop = float("inf") if stop is None else stop
+            data = self.data
+            offsets = [offset for offset in offsets if start <= RECORD.unpack_from(data, offset)[0] < stop]
+        return offsets
+
+    def records(self, start=None, stop=None, src_addrs=None):
+        # (receive time, source, raw frame) of the records selected (see select)
+        for offset in self.select(start, stop, src_addrs):
+            yield self.record(offset)
+
+    def frames(self, start=None, stop=None, src_addrs=None):
+        # a FrameData for each record selected
+        for timestamp, source, raw in self.records(start, stop, src_addrs):
+            frame = fd.FrameData(raw, source)
+            frame.timestamp = timestamp
+            yield frame
+
+    def close(self):
+        for view in self.views:
+            view.release()
+        self.indexData.close()
+        self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def iter_frames(path, start=None, stop=None, on_error=None, fcs_check=None, on_bad_fcs=None, frame_filter=None):
+    # a FrameData for each frame of a binary capture received from start to stop, as frame_reader.iter_frames
+    # the index selects the records of the filter's source addresses, the rest of the filter is checked on each one
+    # on_error is called with the hex of a record too short to be a frame
+    src_addrs = None if frame_filter is None else frame_filter.srcAddrs
+    if metrics.METRICS is not None:
+        on_error = fr.counted(on_error, metrics.METRICS, "malformed")
+    gate = fr.frame_gate(fcs_check, on_bad_fcs, frame_filter, on_error)
+    with CaptureReader(path) as reader:
+        for timestamp, source, raw in reader.records(start, stop, src_addrs):
+            frame = gate(raw, source)
+            if frame is not None:
+                frame.timestamp = timestamp
+                yield frame
+
+class RecordingWriter:
+    # wraps a frame_output writer, also appends each frame written to a capture, with the time it was read (timestamp)
+    def __init__(self, writer, capture):
+        self.writer = writer
+        self.capture = capture
+
+    def record(self, frame):
+        self.capture.write(frame.raw, frame.source, frame.timestamp)
+
+    def format(self, frame):
+        metrics.timed_track(self.record, frame)
+        return self.writer.format(frame)
+
+    def emit(self, data):
+        self.writer.emit(data)
+
+    def write(self, frame):
+        self.emit(self.format(frame))
+
+    def status(self, message):
+        self.writer.status(message)
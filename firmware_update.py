@@ -0,0 +1,266 @@
+import mmap
+import os
+import time
+import zlib
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+import message_payload as mp
+
+# Firmware update (OTA) reassembly, fed with decoded frames
+# A node that needs an update sends Firmware Update Data Requests (MsgFwUpdateRequest: size and checksum of the
+# image it wants, offset it is at, nodes asked to serve it), its neighbours send the image in Firmware Update Data
+# messages (MsgFwUpdateData: offset, length, octets). The chunks are copied into one preallocated buffer per image
+# (size, checksum), shared by every node updating to it, so a network-wide rollout holds each image once.
+# The CRC32 is computed as the image fills in from offset 0, each octet once, and checked against the checksum of the
+# request. Nodes advertise the checksums of their firmware in join requests and almanacs: an image is also matched
+# against these, e.g. to see which nodes run it once it is installed.
+# The two messages are not registered for the default payload walk (MSG_DECODERS), which skips their message IDs:
+# from the first one it skipped, a payload is walked again here with them.
+
+MAX_IMAGES = 4  # images reassembled at a time, the least recently active is dropped for a new one
+MAX_IMAGE_SIZE = 512 * 1024  # DWM1001 (nRF52832) flash, larger requests are ignored
+BROADCAST = 0xffff
+NO_SERVER = (0x0000, 0xffff)  # unused address slots of a request
+
+# default walk plus the firmware update messages
+DECODERS = dict(mp.MSG_DECODERS)
+DECODERS.update({int(msgType.MSG_ID, 16): msgType for msgType in (mp.MsgFwUpdateRequest, mp.MsgFwUpdateData)})
+FW_MSG_IDS = tuple(int(msgType.MSG_ID, 16) for msgType in (mp.MsgFwUpdateRequest, mp.MsgFwUpdateData))
+
+class FirmwareImage:
+    def __init__(self, size, checksum, directory=None):
+        self.size = size  # octets
+        self.checksum = checksum  # CRC32 given by the requests
+        self.path = None
+        self.file = None
+        if directory is None:
+            self.buffer = bytearray(size)
+        else:  # memory-mapped file, left on disk (complete or not) when the image is closed
+            self.path = os.path.join(directory, "firmware-{0:08x}-{1}.bin".format(checksum, size))
+            self.file = open(self.path, "w+b")
+            self.file.truncate(size)
+            self.buffer = mmap.mmap(self.file.fileno(), size)
+        # octets received, as sorted, disjoint [start, stop) ranges: starts[i] to stops[i]
+        self.starts = []
+        self.stops = []
+        self.received = 0  # distinct octets
+        self.chunks = 0
+        self.duplicates = 0  # octets received again
+        self.conflicts = 0  # chunks with other octets than received before for the same offsets
+        self.outOfRange = 0  # chunks past the end of the image
+        self.crc = 0  # CRC32 of the octets from 0 to crcOffset
+        self.crcOffset = 0
+        self.requesters = set()  # nodes updating to it
+        self.servers = set()  # nodes that sent chunks of it
+        self.firstSeen = None
+        self.lastSeen = None
+
+    def add(self, offset, data):
+        # copy a chunk in, returns True if it completes the image
+        if not data:  # no octets (data length 0, or a truncated message)
+            return False
+        stop = offset + len(data)
+        self.chunks += 1
+        if stop > self.size:
+            self.outOfRange += 1
+            return False
+        # received ranges the chunk overlaps or touches, merged with it into one
+        lo = bisect_left(self.stops, offset)
+        hi = bisect_right(self.starts, stop)
+        overlap = 0
+        for i in range(lo, hi):
+            start_i, stop_i = max(self.starts[i], offset), min(self.stops[i], stop)
+            if start_i < stop_i:
+                overlap += stop_i - start_i
+                if self.buffer[start_i:stop_i] != data[start_i-offset:stop_i-offset]:
+                    self.conflicts += 1  # keep the octets received first
+                    return False
+        self.buffer[offset:stop] = data
+        self.received += len(data) - overlap
+        self.duplicates += overlap
+        if lo < hi:
+            self.starts[lo:hi] = [min(self.starts[lo], offset)]
+            self.stops[lo:hi] = [max(self.stops[hi-1], stop)]
+        else:
+            self.starts.insert(lo, offset)
+            self.stops.insert(lo, stop)
+        # extend the CRC over the octets now received from 0
+        if self.starts[0] == 0 and self.stops[0] > self.crcOffset:
+            self.crc = zlib.crc32(self.buffer[self.crcOffset:self.stops[0]], self.crc)
+            self.crcOffset = self.stops[0]
+            return self.crcOffset == self.size
+        return False
+
+    def is_complete(self):
+        return self.crcOffset == self.size
+
+    def verified(self):
+        # whether the CRC32 matches the checksum, None until the image is complete
+        return self.crc == self.checksum if self.is_complete() else None
+
+    def missing(self):
+        # [start, stop) ranges not received yet
+        ranges = []
+        position = 0
+        for start, stop in zip(self.starts, self.stops):
+            if start > position:
+                ranges.append((position, start))
+            position = stop
+        if position < self.size:
+            ranges.append((position, self.size))
+        return ranges
+
+    def image(self):
+        # octets of the complete image, None before
+        return bytes(self.buffer) if self.is_complete() else None
+
+    def close(self):
+        if self.file is not None:
+            self.buffer.flush()
+            self.buffer.close()
+            self.file.close()
+
+    def to_dict(self):
+        return {"size": self.size, "checksum": "%08x" % self.checksum, "received": self.received, "chunks": self.chunks,
+                "missing": self.missing(), "duplicates": self.duplicates, "conflicts": self.conflicts,
+                "outOfRange": self.outOfRange, "crc": "%08x" % self.crc, "crcOffset": self.crcOffset,
+                "complete": self.is_complete(), "verified": self.verified(), "requesters": ["%04x" % address for address in sorted(self.requesters)],
+                "servers": ["%04x" % address for address in sorted(self.servers)], "path": self.path, "firstSeen": self.firstSeen, "lastSeen": self.lastSeen}
+
+class NodeFirmware:
+    __slots__ = ("address", "checksums", "image", "offset")
+
+    def __init__(self, address):
+        self.address = address  # int
+        self.checksums = set()  # firmware checksums it advertised (join requests, almanacs)
+        self.image = None  # (size, checksum) of the image it requested last
+        self.offset = None  # offset of its last request
+
+    def to_dict(self):
+        return {"address": "%04x" % self.address, "checksums": sorted("%08x" % checksum for checksum in self.checksums),
+                "image": None if self.image is None else {"size": self.image[0], "checksum": "%08x" % self.image[1]},
+                "offset": self.offset}
+
+class FirmwareReassembler:
+    def __init__(self, max_images=MAX_IMAGES, max_size=MAX_IMAGE_SIZE, directory=None):
+        self.maxImages = max_images
+        self.maxSize = max_size
+        self.directory = directory  # memory-map the images to files in it, in memory if None
+        self.images = OrderedDict()  # (size, checksum) -> FirmwareImage, least recently active first
+        self.nodes = {}  # address (int) -> NodeFirmware
+        self.servers = {}  # address (int) -> (size, checksum) of the image it was last asked to serve
+        self.dropped = 0  # images dropped for newer ones before they were complete
+        self.unmatched = 0  # chunks that could not be assigned to an image
+
+    def node(self, address):
+        node = self.nodes.get(address)
+        if node is None:
+            node = self.nodes[address] = NodeFirmware(address)
+        return node
+
+    def update(self, frame, now=None):
+        # process one FrameData, returns the images it completed (usually none)
+        completed = []
+        header = frame.macHeader
+        if header.srcAddr is None:
+            return completed
+        messages = frame.payload.messages
+        raw = frame.raw[header.get_length():len(frame.raw)-2]  # payload
+        octets = bytes(raw)
+        if FW_MSG_IDS[0] in octets or FW_MSG_IDS[1] in octets:  # quick check on any of the octets first
+            # the default walk does not know the chunks are data: it is followed up to the first firmware update
+            # message ID it skipped, from which the payload is walked with these messages
+            skipped = []
+            mp.message_ids(raw, FW_MSG_IDS, skipped)
+            if skipped:
+                start, num_messages = skipped[0]
+                messages = messages[:num_messages] + mp.decode_messages(raw, DECODERS, start)
+        now = time.time() if now is None else now
+        src = header.srcAddr.octets
+        dest = None if header.destAddr is None else header.destAddr.octets
+        for msg in messages:
+            msgType = type(msg)
+            if msgType is mp.MsgFwUpdateData:
+                self.data(src, msg, now, completed)
+            elif msgType is mp.MsgFwUpdateRequest:
+                self.request(src, dest, msg, now)
+            elif msgType is mp.MsgJoinRequest:
+                self.node(src).checksums.add(msg.firmwareChecksum.octets)
+            elif msgType is mp.MsgAlmanac:
+                self.node(src).checksums.update((msg.firmware1Checksum.octets, msg.firmware2Checksum.octets))
+        return completed
+
+    def image(self, key, now):
+        # image of a request, allocated on the first one
+        image = self.images.get(key)
+        if image is None:
+            if len(self.images) >= self.maxImages:
+                old_key, old = self.images.popitem(last=False)
+                if not old.is_complete():
+                    self.dropped += 1
+                old.close()
+            image = self.images[key] = FirmwareImage(key[0], key[1], self.directory)
+            image.firstSeen = now
+        else:
+            self.images.move_to_end(key)
+        image.lastSeen = now
+        return image
+
+    def request(self, src, dest, msg, now):
+        size = msg.firmwareSize.octets
+        if not 0 < size <= self.maxSize:
+            return
+        key = (size, msg.firmwareChecksum.octets)
+        image = self.image(key, now)
+        image.requesters.add(src)
+        node = self.node(src)
+        node.image = key
+        node.offset = msg.offset.octets
+        # nodes asked to send it: the destination of the request, and its address slots
+        for address in (dest, msg.addr16_0.octets, msg.addr16_1.octets, msg.addr16_2.octets, msg.addr16_3.octets):
+            if address is not None and address not in NO_SERVER:
+                self.servers[address] = key
+
+    def data(self, src, msg, now, completed):
+        # the chunk is of the image its sender was asked to serve, or of the only image being reassembled
+        key = self.servers.get(src)
+        if key not in self.images:
+            if len(self.images) != 1:
+                self.unmatched += 1
+                return
+            key = next(iter(self.images))
+        image = self.images[key]
+        self.images.move_to_end(key)
+        image.lastSeen = now
+        image.servers.add(src)
+        if image.add(msg.offset.octets, msg.raw[msg.HEADER_LENGTH:msg.length]):
+            completed.append(image)
+
+    def advertised_by(self, image):
+        # nodes advertising the image's CRC32 as one of their firmware checksums
+        crc = image.crc if image.is_complete() else image.checksum
+        return sorted(node.address for node in self.nodes.copy().values() if crc in node.checksums)
+
+    def snapshot(self):
+        # image and node dicts, the indexes are copied in one step so updates go on meanwhile
+        images = []
+        for image in self.images.copy().values():
+            image_dict = image.to_dict()
+            image_dict["advertisedBy"] = ["%04x" % address for address in self.advertised_by(image)]
+            images.append(image_dict)
+        return {"images": images, "nodes": {"%04x" % address: node.to_dict() for address, node in self.nodes.copy().items()},
+                "dropped": self.dropped, "unmatched": self.unmatched}
+
+    def to_string(self):
+        lines = []
+        for image in self.images.copy().values():
+            verified = image.verified()
+            state = "receiving" if verified is None else ("CRC OK" if verified else "CRC MISMATCH (%08x)" % image.crc)
+            lines.append("Firmware {0:08x} ({1} octets): {2}/{1} received, {3} gaps, {4} conflicts, {5}".format(
+                image.checksum, image.size, image.received, len(image.missing()), image.conflicts, state))
+        return "\n".join(lines)
+
+    def close(self):
+        for image in self.images.values():
+            image.close()
@@ -1,12 +1,22 @@
-from helper import octets_to_binary, slice_bits, slice_octets, Bits, BitFlag, OctetData
+from helper import record_value, fields_to_dict, fcs16, escape, Bits, BitFlag, OctetData, LazyField, UINT_LE
 
 import message_payload as mp
 
 class FrameType:
-    def __init__(self, bits):
-        self.data = Bits(bits)
-        # decode Frame Type
-        self.frameType = self.decode_frame_type(bits)
+    __slots__ = ("value",)
+    # FC bits 2 to 0 -> frame type
+    FRAME_TYPES = ("Beacon", "Data", "Acknowledgement", "MAC Command", "Reserved", "Reserved", "Reserved", "Reserved")
+
+    def __init__(self, value):
+        self.value = value
+
+    @property
+    def data(self):
+        return Bits(self.value, 3)
+
+    @property
+    def frameType(self):
+        return self.FRAME_TYPES[self.value]
 
     def get_data(self):
         return self.frameType
@@ -14,65 +24,67 @@ class FrameType:
     def to_string(self):
         return "Frame Type: {0} ({1})".format(self.frameType, self.data.to_string())
 
-    def decode_frame_type(self, bits):
-        # FC bits 2 to 0
-        if bits == "000":
-            return "Beacon"
-        elif bits == "001":
-            return "Data"
-        elif bits == "010":
-            return "Acknowledgement"
-        elif bits == "011":
-            return "MAC Command"
-        else:
-            return "Reserved"
-
 class AddressMode:
+    __slots__ = ("value",)
     NO_ADDR_OR_PANID = "No address or PAN ID present"
     RESERVED = "Reserved"
     SHORT_ADDR = "Short (16-bit) address"
     LONG_ADDR = "Extended (64-bit) address"
+    # FC bits 11 & 10 (dest) or 15 & 14 (src) -> address mode
+    ADDR_MODES = (NO_ADDR_OR_PANID, RESERVED, SHORT_ADDR, LONG_ADDR)
+    # no. address octets for each mode, indexed by the 2 FC bits
+    ADDR_OCTETS = (0, 0, 2, 8)
+
+    def __init__(self, value):
+        self.value = value
 
-    def __init__(self, bits):
-        self.data = Bits(bits)
-        # decode Address Mode
-        self.addrMode = self.decode_addr_mode(bits)
+    @property
+    def data(self):
+        return Bits(self.value, 2)
+
+    @property
+    def addrMode(self):
+        return self.ADDR_MODES[self.value]
 
     def get_data(self):
         return self.addrMode
 
-    def decode_addr_mode(self, bits):
-        # FC bits 11 & 10 (dest) or 15 & 14 (src)
-        if bits == "00":
-            return self.NO_ADDR_OR_PANID
-        elif bits == "01":
-            return self.RESERVED
-        elif bits == "10":
-            return self.SHORT_ADDR
-        elif bits == "11":
-            return self.LONG_ADDR
-
     def to_string(self):
         return "Address Mode: {0} ({1})".format(self.addrMode, self.data.to_string())
 
 class FrameControl:
-    def __init__(self, hex_fc):
-        self.data = OctetData(hex_fc, "Frame Control (FC)", True)
-        # decode FC - bit 0 refers to LSB, data (bytes) is in Little endian format
-        bits = octets_to_binary(hex_fc, 2, "little")
-        self.frameType = FrameType(slice_bits(bits, 0, 2, 16, True))
-        self.securityEnabled = BitFlag(slice_bits(bits, 3, 3, 16, True), "Security Enabled")
-        self.framePending = BitFlag(slice_bits(bits, 4, 4, 16, True), "Frame Pending")
-        self.ACKRequest = BitFlag(slice_bits(bits, 5, 5, 16, True), "ACK Request")
-        self.PANIDCompress = BitFlag(slice_bits(bits, 6, 6, 16, True), "PAN ID Compress")
-        self.destAddrMode = AddressMode(slice_bits(bits, 10, 11, 16, True))
-        self.frameVersion = OctetData(slice_bits(bits, 12, 13, 16, True), "Frame Version", False)
-        self.srcAddrMode = AddressMode(slice_bits(bits, 14, 15, 16, True))
+    FIELDS = ("frameType", "securityEnabled", "framePending", "ACKRequest", "PANIDCompress", "destAddrMode", "frameVersion", "srcAddrMode")
+    def __init__(self, value):  # FC value, its 2 octets read in little endian
+        # decoded once per FC value and shared by every frame with that FC (see header_layout), so never modified
+        self.value = value
+        self.data = OctetData(int.from_bytes(value.to_bytes(2, "little"), "big"), 2, "Frame Control (FC)", True)  # octets as sent
+        # FC sub-fields, bit 0 refers to LSB
+        self.frameType = FrameType(value & 0b111)  # bits 2 to 0
+        self.securityEnabled = BitFlag((value >> 3) & 1, "Security Enabled")
+        self.framePending = BitFlag((value >> 4) & 1, "Frame Pending")
+        self.ACKRequest = BitFlag((value >> 5) & 1, "ACK Request")
+        self.PANIDCompress = BitFlag((value >> 6) & 1, "PAN ID Compress")
+        self.destAddrMode = AddressMode((value >> 10) & 0b11)  # bits 11 & 10
+        self.frameVersion = OctetData((value >> 12) & 0b11, 1, "Frame Version", False)  # bits 13 & 12
+        self.srcAddrMode = AddressMode((value >> 14) & 0b11)  # bits 15 & 14
+        self.breakdowns = {}  # num_spaces -> data_breakdown, the same for every frame with this FC
+
+    def to_record(self):
+        return tuple(record_value(getattr(self, name)) for name in self.FIELDS)
+
+    def to_dict(self):
+        return fields_to_dict(self, self.FIELDS)
 
     def to_string(self):
         return self.data.to_string()  # Frame Control (FC) data
 
     def data_breakdown(self, num_spaces):
+        data_str = self.breakdowns.get(num_spaces)
+        if data_str is None:
+            data_str = self.breakdowns[num_spaces] = self.render_breakdown(num_spaces)
+        return data_str
+
+    def render_breakdown(self, num_spaces):
         start_spacing = ""
         for i in range(num_spaces):
             start_spacing += "  "
@@ -94,61 +106,153 @@ class FrameControl:
         return data_str
 
 
-class MACHeader:
-    def __init__(self, data):  # pass in entire frame data, as non-DWM1001 frames could be a variable length
-        # Decode Frame Control (FC) first to determine MAC Header length and parameters
-        self.frameControl = FrameControl(slice_octets(data, 0, 2))  # first 2 bytes
-        self.sequenceNumber = OctetData(slice_octets(data, 2, 1), "Sequence Number", False)
+class HeaderLayout:
+    # where each MAC header field is, as fixed by the FC (index None if not present)
+    __slots__ = ("frameControl", "destPANID_idx", "destAddr_idx", "srcPANID_idx", "srcAddr_idx", "destAddrOctets", "srcAddrOctets", "length",
+                 "breakdownFields", "breakdowns")
+
+    def __init__(self, fc):
+        self.frameControl = FrameControl(fc)
+        destAddrOctets = AddressMode.ADDR_OCTETS[(fc >> 10) & 0b11]  # FC bits 11 & 10
+        srcAddrOctets = AddressMode.ADDR_OCTETS[(fc >> 14) & 0b11]  # FC bits 15 & 14
 
-        # depending on decoded FC, process the following header data
         # Destination PANID and Address
-        if self.frameControl.destAddrMode.addrMode != AddressMode.NO_ADDR_OR_PANID and self.frameControl.destAddrMode.addrMode != AddressMode.RESERVED:  # there is a destination address
-            self.destPANID = OctetData(slice_octets(data, 3, 2, endianness="little"), "Destination PAN ID", False)
-            if self.frameControl.destAddrMode.addrMode == AddressMode.SHORT_ADDR:
-                self.destAddr = OctetData(slice_octets(data, 5, 2, endianness="little"), "Destination Address", False)
-                srcPANID_idx = 7
-            else:  #elif self.frameControl.destAddrMode.addrMode == AddressMode.LONG_ADDR:
-                self.destAddr = OctetData(slice_octets(data, 5, 8, endianness="little"), "Destination Address", False)            
-                srcPANID_idx = 13
+        if destAddrOctets:  # there is a destination address
+            self.destPANID_idx = 3
+            self.destAddr_idx = 5
+            srcPANID_idx = self.destAddr_idx + destAddrOctets
         else:
-            self.destPANID = None
-            self.destAddr = None
+            self.destPANID_idx = None
+            self.destAddr_idx = None
             srcPANID_idx = 3
-        
+
         # Source PANID and Address
-        if self.frameControl.srcAddrMode.addrMode != AddressMode.NO_ADDR_OR_PANID and self.frameControl.srcAddrMode.addrMode != AddressMode.RESERVED:  # there is a source address
-            if not self.frameControl.PANIDCompress.value:  # DWM1001 compresses PAN ID
-                self.srcPANID = OctetData(slice_octets(data, srcPANID_idx, 2, endianness="little"), "Source PAN ID", False)
-                srcAddr_idx = srcPANID_idx + 2
+        if srcAddrOctets:  # there is a source address
+            if not (fc >> 6) & 0b1:  # PAN ID Compress (FC bit 6), DWM1001 compresses PAN ID
+                self.srcPANID_idx = srcPANID_idx
+                self.srcAddr_idx = srcPANID_idx + 2
             else:
-                self.srcPANID = None
-                srcAddr_idx = srcPANID_idx
-            if self.frameControl.srcAddrMode.addrMode == AddressMode.SHORT_ADDR:
-                self.srcAddr = OctetData(slice_octets(data, srcAddr_idx, 2, endianness="little"), "Source Address", False)
-                auxSecurityHeader_idx = srcAddr_idx + 2
-            else:  #elif self.frameControl.srcAddrMode.addrMode == AddressMode.LONG_ADDR:
-                self.srcAddr = OctetData(slice_octets(data, srcAddr_idx, 8, endianness="little"), "Source Address", False)
-                auxSecurityHeader_idx = srcAddr_idx + 8
+                self.srcPANID_idx = None
+                self.srcAddr_idx = srcPANID_idx
+            auxSecurityHeader_idx = self.srcAddr_idx + srcAddrOctets
         else:
-            self.srcPANID = None
-            self.srcAddr = None
+            self.srcPANID_idx = None
+            self.srcAddr_idx = None
             auxSecurityHeader_idx = srcPANID_idx
+        self.destAddrOctets = destAddrOctets
+        self.srcAddrOctets = srcAddrOctets
 
         # Aux Security Header
         #if not self.frameControl.securityEnabled:  # DWM1001 does not have this, so it is always False
-        self.auxSecurityHeader = None
         # auxSecurityHeader_idx = length of MAC header
+        self.length = auxSecurityHeader_idx
+
+        # header fields after the sequence number, as (label, index, no. octets), and the data_breakdown format
+        # string of the header for each num_spaces (see breakdown_format)
+        self.breakdownFields = tuple((label, idx, num_octets) for label, idx, num_octets in (
+            ("Destination PAN ID", self.destPANID_idx, 2), ("Destination Address", self.destAddr_idx, destAddrOctets),
+            ("Source PAN ID", self.srcPANID_idx, 2), ("Source Address", self.srcAddr_idx, srcAddrOctets)) if idx is not None)
+        self.breakdowns = {}
+
+    def breakdown_format(self, num_spaces):
+        # MACHeader.data_breakdown of a frame with this FC, FC breakdown included, with the hex of the header and of
+        # each field left to fill in
+        fmt = self.breakdowns.get(num_spaces)
+        if fmt is None:
+            start_spacing = "  " * num_spaces
+            indented = start_spacing + "  "
+            fmt = start_spacing + "MAC Header: 0x{} - Length: " + str(self.length) + "\n"
+            fmt += escape(self.frameControl.data_breakdown(num_spaces+1)) + "\n"
+            fmt += indented + "Sequence Number: 0x{}\n"
+            for label, idx, num_octets in self.breakdownFields:
+                fmt += indented + label + ": 0x{}\n"
+            self.breakdowns[num_spaces] = fmt
+        return fmt
+
+# FC value -> HeaderLayout, a DWM1001 network only uses a handful of FC values (and there are at most 2^16)
+HEADER_LAYOUTS = {}
+
+def header_layout(fc):
+    layout = HEADER_LAYOUTS.get(fc)
+    if layout is None:
+        layout = HEADER_LAYOUTS[fc] = HeaderLayout(fc)
+    return layout
+
+class MACHeader:
+    FIELDS = ("sequenceNumber", "destPANID", "destAddr", "srcPANID", "srcAddr")  # header fields after FC
+    auxSecurityHeader = None  # DWM1001 does not have this
+
+    def __init__(self, data):  # pass in entire frame data, as non-DWM1001 frames could be a variable length
+        # keep the raw frame, header fields are decoded on first access
+        self.raw = data
+        # Frame Control (FC) determines the MAC Header length and where each field is, only the other fields vary between frames
+        self.layout = header_layout(UINT_LE[2].unpack_from(data, 0)[0])
+        self.length = self.layout.length
+
+    @property
+    def frameControl(self):
+        return self.layout.frameControl
+
+    @LazyField
+    def sequenceNumber(self):
+        return OctetData.from_buffer(self.raw, 2, 1, "Sequence Number", False)
+
+    @LazyField
+    def destPANID(self):
+        if self.layout.destPANID_idx is None:
+            return None
+        return OctetData.from_buffer(self.raw, self.layout.destPANID_idx, 2, "Destination PAN ID", False, byte_order="little")
 
+    @LazyField
+    def destAddr(self):
+        if self.layout.destAddr_idx is None:
+            return None
+        return OctetData.from_buffer(self.raw, self.layout.destAddr_idx, self.layout.destAddrOctets, "Destination Address", False, byte_order="little")
+
+    @LazyField
+    def srcPANID(self):
+        if self.layout.srcPANID_idx is None:
+            return None
+        return OctetData.from_buffer(self.raw, self.layout.srcPANID_idx, 2, "Source PAN ID", False, byte_order="little")
+
+    @LazyField
+    def srcAddr(self):
+        if self.layout.srcAddr_idx is None:
+            return None
+        return OctetData.from_buffer(self.raw, self.layout.srcAddr_idx, self.layout.srcAddrOctets, "Source Address", False, byte_order="little")
+
+    @LazyField
+    def data(self):
         # Store the total header as data
-        self.data = OctetData(slice_octets(data, 0, auxSecurityHeader_idx), "MAC Header", False)
+        return OctetData.from_buffer(self.raw, 0, self.length, "MAC Header", False)
 
     def get_length(self):
-        return self.data.length
+        return self.length
+
+    def to_record(self):
+        # compact, picklable form of the header: (FC value, field values...)
+        return (self.frameControl.value,) + tuple(record_value(getattr(self, name)) for name in self.FIELDS)
+
+    def to_dict(self):
+        header_dict = {"frameControl": self.frameControl.to_dict()}
+        header_dict.update(fields_to_dict(self, self.FIELDS))
+        return header_dict
 
     def to_string(self):
         return self.data.to_string()  # MAC Header data
 
     def data_breakdown(self, num_spaces):
+        raw = self.raw
+        if len(raw) < self.length:  # truncated header
+            return self.truncated_breakdown(num_spaces)
+        # the layout's format string, filled in with the header octets and its fields (read in little endian)
+        args = [raw[:self.length].hex(), "%02x" % raw[2]]
+        for label, idx, num_octets in self.layout.breakdownFields:
+            args.append("%0*x" % (num_octets*2, int.from_bytes(raw[idx:idx+num_octets], "little")))
+        return self.layout.breakdown_format(num_spaces).format(*args)
+
+    def truncated_breakdown(self, num_spaces):
+        # field by field, the fields cut off keep the octets there are
         start_spacing = ""
         for i in range(num_spaces):
             start_spacing += "  "
@@ -175,18 +279,57 @@ class MACHeader:
         return data_str
 
 
+MIN_FRAME_LENGTH = 4  # FC and FCS, a shorter frame cannot be decoded
+
+def fcs_valid(raw):
+    # check the FCS (last 2 octets, little endian) of a raw frame, without decoding the frame
+    if len(raw) < 2:
+        return False
+    return fcs16(raw[:len(raw)-2]) == UINT_LE[2].unpack_from(raw, len(raw)-2)[0]
+
 class FrameData:
-    def __init__(self, data):
-        # store the data
-        self.data = OctetData(data, "UWB Frame Data", False)
+    def __init__(self, data, source=None):  # raw frame as bytes/memoryview, or the sniffer's hex string
+        if isinstance(data, str):
+            data = bytes.fromhex(data)
+        # keep the raw frame, each part is decoded on first access
+        # fields are read straight from the buffer, slices of a memoryview do not copy
+        self.raw = memoryview(data)
+        self.source = source  # sniffer the frame was received from, when reading several
+        self.fcsValid = None  # result of the FCS check (see verify_fcs), None if not checked
+        self.receiveTime = None  # time.monotonic() when read, set by a frame_reader.ReaderThread
+        self.timestamp = None  # time.time() when read (s since the epoch), None if not known
+
+    @LazyField
+    def data(self):
+        return OctetData.from_buffer(self.raw, 0, len(self.raw), "UWB Frame Data", False)
+
+    @LazyField
+    def macHeader(self):
         # 1. Decode MAC header
-        self.macHeader = MACHeader(data)
+        return MACHeader(self.raw)
+
+    @LazyField
+    def payload(self):
         # 2. Decode message payload
-        start = self.macHeader.get_length()*2
-        stop = len(data) - 4  # excluding last 2 bytes
-        self.payload = mp.MessagePayload(data[start : stop])  # rest of the data, excluding FCS
+        start = self.macHeader.get_length()
+        stop = len(self.raw) - 2  # excluding last 2 bytes
+        return mp.MessagePayload(self.raw[start : stop])  # rest of the data, excluding FCS
+
+    @LazyField
+    def fcs(self):
         # 3. Extract FCS (last 2 bytes)
-        self.fcs = OctetData(data[stop:], "Frame Check Sequence (FCS)", False)
+        return OctetData.from_buffer(self.raw, len(self.raw)-2, 2, "Frame Check Sequence (FCS)", False)
+
+    def verify_fcs(self):
+        self.fcsValid = fcs_valid(self.raw)
+        return self.fcsValid
+
+    def to_record(self):
+        # compact, picklable form of the frame, instead of the decoded object tree
+        return (self.macHeader.to_record(), self.payload.to_record(), self.fcs.get_data())
+
+    def to_dict(self):
+        return {"source": self.source, "macHeader": self.macHeader.to_dict(), "messages": self.payload.to_dict(), "fcs": self.fcs.get_data(), "fcsValid": self.fcsValid}
 
     def data_breakdown(self, num_spaces):
         start_spacing = ""
@@ -195,11 +338,13 @@ class FrameData:
         indented = start_spacing + "  "
         data_str = ""
         # Frame metadata
-        data_str += start_spacing + self.data.to_string() + " - "   # Frame Data
-        data_str += "Length: " + str(self.data.length) + "\n"    # Frame Data length
+        data_str += start_spacing + "UWB Frame Data: 0x" + self.raw.hex() + " - "   # Frame Data (as self.data.to_string())
+        data_str += "Length: " + str(len(self.raw)) + "\n"    # Frame Data length
         # Message contents
         data_str += self.macHeader.data_breakdown(num_spaces+1)  # MAC Header
         data_str += self.payload.data_breakdown(num_spaces+1)    # Payload
-        data_str += indented + self.fcs.to_string()     # FCS
+        data_str += indented + "Frame Check Sequence (FCS): 0x" + self.raw[len(self.raw)-2:].hex()     # FCS (as self.fcs.to_string())
+        if self.fcsValid == False:
+            data_str += " - FCS mismatch"
         # return data
         return data_str
\ No newline at end of file
@@ -0,0 +1,85 @@
+import frame_data as fd
+import message_payload as mp
+
+# Frame filters evaluated on the raw frame, so frames that do not match are dropped before anything is decoded.
+# The FC gives the offset of every MAC header field (frame_data.header_layout), the message IDs are found by
+# walking the payload octets as MessagePayload does.
+
+def to_int(value):
+    # addresses, PAN IDs and message IDs as printed (hex string) or as int
+    return int(value, 16) if isinstance(value, str) else value
+
+def to_set(values, convert=to_int):
+    return None if values is None else frozenset(convert(value) for value in values)
+
+def is_hex(value):
+    # whether an address or PAN ID given as text can be read by to_int
+    try:
+        return int(value, 16) >= 0
+    except ValueError:
+        return False
+
+def known_msg_id(value):
+    # True if the payload walk finds messages of this ID (hex string or int), i.e. it is registered in
+    # MSG_DECODERS: the IDs it skips (firmware update, service, bridge node beacon) can never match
+    try:
+        return to_int(value) in mp.MSG_DECODERS
+    except ValueError:  # not hex
+        return False
+
+def frame_type_value(frame_type):
+    # frame type name (as printed, e.g. "Data") or FC bits 2 to 0
+    if isinstance(frame_type, str):
+        return fd.FrameType.FRAME_TYPES.index(frame_type)
+    return frame_type
+
+def read_uint(raw, idx, num_octets):
+    return int.from_bytes(raw[idx:idx+num_octets], "little")
+
+def source_address(raw):
+    # source address (int) of a raw frame, None if it has none or is truncated
+    if len(raw) < 5:
+        return None
+    layout = fd.header_layout(raw[0] | raw[1] << 8)
+    if layout.srcAddr_idx is None or layout.length + 2 > len(raw):
+        return None
+    return read_uint(raw, layout.srcAddr_idx, layout.srcAddrOctets)
+
+class FrameFilter:
+    # each criterion is a collection of accepted values, or None to accept any value
+    # a frame matches if it meets every criterion given
+    def __init__(self, src_addrs=None, dest_addrs=None, pan_ids=None, frame_types=None, msg_ids=None):
+        self.srcAddrs = to_set(src_addrs)
+        self.destAddrs = to_set(dest_addrs)
+        self.panIds = to_set(pan_ids)  # destination or source PAN ID
+        self.frameTypes = to_set(frame_types, frame_type_value)
+        self.msgIds = to_set(msg_ids)  # frames with at least one of these messages
+        if self.msgIds is not None and not self.msgIds <= mp.MSG_DECODERS.keys():
+            raise ValueError("Message IDs {0} are not walked by the decoder".format(
+                ", ".join("{0:02x}".format(msg_id) for msg_id in sorted(self.msgIds - mp.MSG_DECODERS.keys()))))
+
+    def matches(self, raw):
+        # raw frame (bytes/memoryview), including the FCS
+        if len(raw) < 5:  # FC, sequence number and FCS
+            return False
+        fc = raw[0] | raw[1] << 8
+        if self.frameTypes is not None and (fc & 0b111) not in self.frameTypes:
+            return False
+        layout = fd.header_layout(fc)
+        if layout.length + 2 > len(raw):  # truncated header
+            return False
+        if self.srcAddrs is not None:
+            if layout.srcAddr_idx is None or read_uint(raw, layout.srcAddr_idx, layout.srcAddrOctets) not in self.srcAddrs:
+                return False
+        if self.destAddrs is not None:
+            if layout.destAddr_idx is None or read_uint(raw, layout.destAddr_idx, layout.destAddrOctets) not in self.destAddrs:
+                return False
+        if self.panIds is not None:
+            pan_ids = [read_uint(raw, idx, 2) for idx in (layout.destPANID_idx, layout.srcPANID_idx) if idx is not None]
+            if not any(pan_id in self.panIds for pan_id in pan_ids):
+                return False
+        if self.msgIds is not None:
+            payload = memoryview(raw)[layout.length:len(raw)-2]
+            if not any(msg_id in self.msgIds for msg_id in mp.message_ids(payload)):
+                return False
+        return True
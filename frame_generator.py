@@ -0,0 +1,128 @@
+import random
+import struct
+
+import message_payload as mp
+from helper import fcs16
+
+# synthetic, valid DWM1001 frames for benchmarks
+# every generator takes a random.Random, so a seed always gives the same frames
+
+PAN_ID = 0xdeca
+BROADCAST_ADDR = 0xffff
+FC_SHORT_ADDR = 0x8841  # Data frame, PAN ID compressed, short destination and source addresses
+FC_LONG_SRC_ADDR = 0xc841  # same, with an extended source address
+
+# octets that are not a registered message ID, so the payload walk never starts a message inside another one
+FILL_OCTETS = bytes(i for i in range(256) if i not in mp.MSG_DECODERS)
+
+def fill(rng, num_octets):
+    return bytes(rng.choice(FILL_OCTETS) for i in range(num_octets))
+
+def msg_id(msgType):
+    return bytes.fromhex(msgType.MSG_ID)
+
+def coordinates(rng):
+    # position within a 50 m x 50 m x 5 m area
+    return struct.pack("<fff", rng.uniform(-25, 25), rng.uniform(-25, 25), rng.uniform(0, 5))
+
+def beacon(rng):
+    return msg_id(mp.MsgBeacon) + fill(rng, mp.MsgBeacon.LENGTH - 1)
+
+def join_request(rng):
+    return msg_id(mp.MsgJoinRequest) + fill(rng, mp.MsgJoinRequest.LENGTH - 1)
+
+def join_confirmation(rng):
+    return msg_id(mp.MsgJoinConfirmation) + fill(rng, mp.MsgJoinConfirmation.LENGTH - 1)
+
+def almanac(rng):
+    return msg_id(mp.MsgAlmanac) + fill(rng, mp.MsgAlmanac.LENGTH - 1)
+
+def service(rng):
+    argc = rng.randint(0, mp.MsgService.MAX_LENGTH - mp.MsgService.HEADER_LENGTH)
+    return msg_id(mp.MsgService) + fill(rng, 1) + struct.pack("b", argc) + fill(rng, argc)
+
+def fw_update_request(rng):
+    return msg_id(mp.MsgFwUpdateRequest) + fill(rng, mp.MsgFwUpdateRequest.LENGTH - 1)
+
+def fw_update_data(rng):
+    data_length = rng.randint(1, mp.MsgFwUpdateData.MAX_LENGTH - mp.MsgFwUpdateData.HEADER_LENGTH)
+    return msg_id(mp.MsgFwUpdateData) + fill(rng, 6) + struct.pack("b", data_length) + fill(rng, data_length)
+
+def position(rng):
+    return msg_id(mp.MsgPosition) + coordinates(rng) + bytes(4)  # padding
+
+def group_poll(rng):
+    anchors = struct.pack("<HHHH", *(rng.randint(0x1000, 0x1fff) for i in range(4)))
+    twr = struct.pack("BB", rng.randint(0, 255), rng.randint(0, 255))  # TWR sequence number, stationary flag & quality factor
+    return msg_id(mp.MsgGroupPoll) + fill(rng, 2) + struct.pack("<h", 100) + anchors + twr + coordinates(rng) + bytes(2)
+
+def response(rng):
+    return msg_id(mp.MsgResponse) + fill(rng, mp.MsgResponse.LENGTH - 1)
+
+def bridge_node_beacon(rng):
+    count = rng.randint(0, (mp.MsgBridgeNodeBeacon.MAX_LENGTH - mp.MsgBridgeNodeBeacon.HEADER_LENGTH) // 2)
+    return msg_id(mp.MsgBridgeNodeBeacon) + fill(rng, 8) + struct.pack("b", count) + fill(rng, 2*count)
+
+def iot_data(msgType):
+    def generate(rng):
+        data_length = rng.randint(1, msgType.MAX_LENGTH - msgType.HEADER_LENGTH)
+        return msg_id(msgType) + fill(rng, 5) + struct.pack("b", data_length) + fill(rng, data_length)
+    return generate
+
+# message class -> generator of one message (bytes)
+MESSAGE_GENERATORS = {
+    mp.MsgBeacon: beacon,
+    mp.MsgJoinRequest: join_request,
+    mp.MsgJoinConfirmation: join_confirmation,
+    mp.MsgAlmanac: almanac,
+    mp.MsgService: service,
+    mp.MsgFwUpdateRequest: fw_update_request,
+    mp.MsgFwUpdateData: fw_update_data,
+    mp.MsgPosition: position,
+    mp.MsgGroupPoll: group_poll,
+    mp.MsgResponse: response,
+    mp.MsgBridgeNodeBeacon: bridge_node_beacon,
+    mp.MsgIotDataDownlink: iot_data(mp.MsgIotDataDownlink),
+    mp.MsgIotDataUplink: iot_data(mp.MsgIotDataUplink),
+}
+
+def make_frame(payload, seq, src_addr, long_src_addr=False):
+    # MAC header as sent by DWM1001 nodes (broadcast, compressed PAN ID), payload and a valid FCS
+    if long_src_addr:
+        header = struct.pack("<HBHHQ", FC_LONG_SRC_ADDR, seq & 0xff, PAN_ID, BROADCAST_ADDR, src_addr)
+    else:
+        header = struct.pack("<HBHHH", FC_SHORT_ADDR, seq & 0xff, PAN_ID, BROADCAST_ADDR, src_addr)
+    frame = header + payload
+    return frame + struct.pack("<H", fcs16(frame))
+
+# frame mixes, each a list of (weight, message classes in one payload)
+MIXES = {
+    # anchors advertising the network, a few tags reporting
+    "beacon-heavy": [(6, (mp.MsgBeacon,)), (1, (mp.MsgAlmanac,)), (1, (mp.MsgJoinConfirmation,)), (1, (mp.MsgPosition,)),
+                     (1, (mp.MsgJoinRequest,))],
+    # many tags ranging and reporting positions
+    "position-heavy": [(5, (mp.MsgPosition,)), (3, (mp.MsgGroupPoll,)), (3, (mp.MsgResponse,)), (1, (mp.MsgBeacon,))],
+    # beacons with messages appended to them
+    "multi-message": [(3, (mp.MsgBeacon, mp.MsgPosition)), (1, (mp.MsgBeacon, mp.MsgJoinConfirmation, mp.MsgIotDataDownlink)),
+                      (1, (mp.MsgBeacon, mp.MsgIotDataUplink)), (1, (mp.MsgGroupPoll, mp.MsgResponse))],
+}
+
+def generate_frames(mix, num_frames, seed=0, num_nodes=16):
+    # num_frames raw frames (bytes) of a mix, sent by num_nodes nodes (every 4th with an extended address)
+    rng = random.Random(seed)
+    weights = [weight for weight, msgTypes in MIXES[mix]]
+    payloads = [msgTypes for weight, msgTypes in MIXES[mix]]
+    frames = []
+    for i in range(num_frames):
+        msgTypes = rng.choices(payloads, weights)[0]
+        node = rng.randrange(num_nodes)
+        long_src_addr = node % 4 == 3
+        src_addr = (0xdeca000000000000 if long_src_addr else 0x1000) + node
+        payload = b"".join(MESSAGE_GENERATORS[msgType](rng) for msgType in msgTypes)
+        frames.append(make_frame(payload, i, src_addr, long_src_addr))
+    return frames
+
+def generate_messages(msgType, num_messages, seed=0):
+    # num_messages raw messages (bytes) of one message class
+    rng = random.Random(seed)
+    return [MESSAGE_GENERATORS[msgType](rng) for i in range(num_messages)]
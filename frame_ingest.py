@@ -0,0 +1,55 @@
+import asyncio
+import binascii
+import time
+
+import frame_reader as fr
+import metrics
+
+QUEUE_SIZE = 1024  # max. no. frames waiting for the consumer before the readers are held back
+
+async def open_source(url, baud_rate=115200):
+    # "tcp://HOST:PORT" for a TCP serial bridge, anything else is a serial port
+    if url.startswith("tcp://"):
+        host, port = url[len("tcp://"):].rsplit(":", 1)
+        return await asyncio.open_connection(host, int(port))
+    import serial_asyncio  # pyserial-asyncio, only needed for serial ports
+    return await serial_asyncio.open_serial_connection(url=url, baudrate=baud_rate)
+
+async def read_frames(reader, source, queue, on_error=None, fcs_check=None, on_bad_fcs=None, frame_filter=None):
+    # put a FrameData for each line of hex characters into the queue, tagged with its source
+    # the stream reader buffers large reads, each line is split out of its buffer
+    # fcs_check, on_bad_fcs(source, raw) and frame_filter as for frame_reader.iter_frames
+    m = metrics.METRICS
+    if m is not None:  # count malformed lines, as iter_frames does
+        on_error = fr.counted(on_error, m, "malformed")
+    gate = fr.frame_gate(fcs_check, None if on_bad_fcs is None else (lambda raw: on_bad_fcs(source, raw)), frame_filter,
+                         None if on_error is None else (lambda line: on_error(source, line)))
+    async for line in reader:
+        timestamp = time.time()  # the line is complete, before it waits in the queue
+        if m is not None:
+            m.add("lines", labels=(("source", source),))
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            raw = binascii.unhexlify(line)
+        except ValueError:  # not hex, or cut in the middle of an octet
+            if on_error is not None:
+                on_error(source, line.decode("ascii", "replace"))
+            continue
+        frame = gate(raw, source)
+        if frame is None:
+            continue
+        frame.timestamp = timestamp
+        # waits while the queue is full, which stops reading from this source (backpressure)
+        await queue.put(frame)
+
+async def ingest(sources, queue, baud_rate=115200, on_error=None, fcs_check=None, on_bad_fcs=None, frame_filter=None):
+    # read every sniffer concurrently into one queue, until all of them are closed
+    async def run(url):
+        reader, writer = await open_source(url, baud_rate)
+        try:
+            await read_frames(reader, url, queue, on_error, fcs_check, on_bad_fcs, frame_filter)
+        finally:
+            writer.close()
+    await asyncio.gather(*(run(url) for url in sources))
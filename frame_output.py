@@ -0,0 +1,285 @@
+import csv
+import json
+import math
+import queue
+import sys
+import threading
+import time
+
+import message_payload as mp
+import metrics
+
+class TextWriter:
+    # indented breakdown of every field (data_breakdown), the default output
+    def __init__(self, stream=None):
+        self.stream = sys.stdout if stream is None else stream
+
+    def format(self, frame):
+        text = frame.data_breakdown(0) + "\n---------------------\n"
+        if frame.source != None:
+            text = "Source: {}\n".format(frame.source) + text
+        return text
+
+    def emit(self, text):
+        self.stream.write(text)
+
+    def emit_batch(self, texts):
+        self.stream.write("".join(texts))
+
+    def write(self, frame):
+        self.emit(self.format(frame))
+
+    def flush(self):
+        self.stream.flush()
+
+    def status(self, message):
+        self.stream.write(message + "\n")
+
+def finite(value):
+    # NaN and infinities (e.g. a corrupt float field) as None, they are not valid JSON
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: finite(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [finite(item) for item in value]
+    return value
+
+class JsonLinesWriter:
+    # one JSON object (FrameData.to_dict) per line
+    def __init__(self, stream=None):
+        self.stream = sys.stdout if stream is None else stream
+
+    def format(self, frame):
+        frame_dict = frame.to_dict()
+        try:
+            text = json.dumps(frame_dict, separators=(",", ":"), allow_nan=False)
+        except ValueError:  # rare: only walk the dict again when a float is not finite
+            text = json.dumps(finite(frame_dict), separators=(",", ":"), allow_nan=False)
+        return text + "\n"
+
+    def emit(self, text):
+        self.stream.write(text)
+
+    def emit_batch(self, texts):
+        self.stream.write("".join(texts))
+
+    def write(self, frame):
+        self.emit(self.format(frame))
+
+    def flush(self):
+        self.stream.flush()
+
+    def status(self, message):
+        print(message, file=sys.stderr)  # keep the output machine-readable
+
+def message_columns(msgTypes):
+    # columns of the fields of each message class, named class.field (MsgGroupPoll.x -> groupPoll.x)
+    columns = []
+    slices = {}
+    for msgType in msgTypes:
+        prefix = msgType.__name__[3].lower() + msgType.__name__[4:]
+        slices[msgType] = (len(columns), len(columns) + len(msgType.FIELDS))
+        columns += [prefix + "." + name for name in msgType.FIELDS]
+    return columns, slices
+
+class CsvWriter:
+    # one row per message, header fields repeated on each row (frames without messages get one row)
+    HEADER_COLUMNS = ["source", "frameType", "macSequenceNumber", "destPANID", "destAddr", "srcPANID", "srcAddr", "fcs", "fcsValid", "msgId"]
+    # every field of the registered messages, each message only fills its own columns: a column is named after the
+    # message class and the field (e.g. position.x, groupPoll.x), fields of the same name in other messages can differ
+    # in size and meaning
+    # MESSAGE_SLICES: message class -> (first, stop) of its columns in MESSAGE_COLUMNS
+    MESSAGE_COLUMNS, MESSAGE_SLICES = message_columns(mp.MSG_DECODERS.values())
+
+    def __init__(self, stream=None):
+        self.stream = sys.stdout if stream is None else stream
+        self.writer = csv.writer(self.stream)
+        self.writer.writerow(self.HEADER_COLUMNS + self.MESSAGE_COLUMNS)
+
+    def format(self, frame):
+        # rows of the frame
+        rows = []
+        header = frame.macHeader
+        header_row = [frame.source, header.frameControl.frameType.get_data()] + list(header.to_record()[1:]) + [frame.fcs.get_data(), frame.fcsValid]
+        messages = frame.payload.messages
+        if not messages:
+            rows.append(header_row + [None]*(1 + len(self.MESSAGE_COLUMNS)))
+        for msg in messages:
+            record = msg.to_record()
+            columns = [None]*len(self.MESSAGE_COLUMNS)
+            first, stop = self.MESSAGE_SLICES.get(type(msg), (0, 0))
+            columns[first:stop] = [" ".join(value) if isinstance(value, tuple) else value for value in record[1:stop-first+1]]
+            rows.append(header_row + [record[0]] + columns)
+        return rows
+
+    def emit(self, rows):
+        self.writer.writerows(rows)
+
+    def emit_batch(self, frame_rows):
+        self.writer.writerows(row for rows in frame_rows for row in rows)
+
+    def write(self, frame):
+        self.emit(self.format(frame))
+
+    def flush(self):
+        self.stream.flush()
+
+    def status(self, message):
+        print(message, file=sys.stderr)  # keep the output machine-readable
+
+class MsgpackWriter:
+    # stream of MessagePack arrays: [source, MAC header record, message records, FCS] (see FrameData.to_record)
+    def __init__(self, stream=None):
+        import msgpack  # optional, only needed for this format
+        self.stream = sys.stdout.buffer if stream is None else stream
+        self.packer = msgpack.Packer()
+
+    def format(self, frame):
+        return self.packer.pack((frame.source,) + frame.to_record())
+
+    def emit(self, data):
+        self.stream.write(data)
+
+    def emit_batch(self, records):
+        self.stream.write(b"".join(records))
+
+    def write(self, frame):
+        self.emit(self.format(frame))
+
+    def flush(self):
+        self.stream.flush()
+
+    def status(self, message):
+        print(message, file=sys.stderr)  # keep the output machine-readable
+
+# each writer formats a frame (format), then writes the result out (emit, or emit_batch for several)
+# --format name -> writer class
+WRITERS = {"text": TextWriter, "jsonl": JsonLinesWriter, "csv": CsvWriter, "msgpack": MsgpackWriter}
+
+def write_frame(output, frame):
+    # write one frame with any writer (wrapped or not), returns False if it failed to decode
+    # a corrupt frame is reported as a status message and skipped, so the decode loop goes on with the next one;
+    # errors writing the output (OSError, e.g. the consumer of a pipe went away) are still raised
+    try:
+        output.write(frame)
+    except OSError:
+        raise
+    except Exception as e:
+        output.status("Decode error ({0}: {1}): {2}".format(type(e).__name__, e, frame.raw.hex()))
+        return False
+    return True
+
+QUEUE_SIZE = 4096  # max. no. formatted frames waiting to be written
+BATCH_SIZE = 256  # max. no. frames per write
+FLUSH_INTERVAL = 0.2  # max. time (s) a frame waits for its batch to fill up
+# what to do with a frame when the queue is full: wait for room (the reader is held back), or drop it and count it
+WHEN_FULL = ("block", "drop")
+
+class BufferedWriter:
+    # writes the output of another writer from a thread, so the decoding loop never waits on disk or pipe I/O
+    # frames are formatted by the caller, queued, and written out in batches of up to batch_size frames,
+    # or whatever is queued once the oldest frame has waited flush_interval seconds
+    def __init__(self, writer, queue_size=QUEUE_SIZE, when_full="block", batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.writer = writer
+        self.whenFull = when_full
+        self.batchSize = batch_size
+        self.flushInterval = flush_interval
+        self.queue = queue.Queue(queue_size)  # (formatted frame, None) or (None, status message), None to stop
+        self.dropped = 0  # frames dropped on a full queue
+        self.droppedStatus = 0  # status messages dropped on a full queue
+        self.error = None  # exception that stopped the writer thread, raised once by the next call
+        self.errorRaised = False
+        self.metrics = metrics.METRICS
+        self.thread = threading.Thread(target=self.run, name="output-writer", daemon=True)
+        self.thread.start()
+
+    def format(self, frame):
+        return self.writer.format(frame)
+
+    def check(self):
+        # raise the error of the writer thread in the caller
+        if self.error is not None and not self.errorRaised:
+            self.errorRaised = True
+            raise self.error
+
+    def emit(self, data):
+        self.check()
+        if self.whenFull == "drop":
+            try:
+                self.queue.put_nowait((data, None))
+            except queue.Full:
+                self.dropped += 1
+                if self.metrics is not None:
+                    self.metrics.add("dropped")
+        elif not self.put((data, None)):
+            self.errorRaised = True
+            raise self.error
+        if self.metrics is not None:
+            self.metrics.set("output_queue_depth", self.queue.qsize())
+
+    def write(self, frame):
+        self.emit(self.format(frame))
+
+    def status(self, message):
+        # in order with the frames, dropped as they are on a full queue (the reader calls it too, e.g. on a serial timeout)
+        if self.error is not None:
+            return
+        if self.whenFull == "drop":
+            try:
+                self.queue.put_nowait((None, message))
+            except queue.Full:
+                self.droppedStatus += 1
+        else:
+            self.put((None, message))
+
+    def put(self, item):
+        # block until the queue has room, False if the writer thread stops meanwhile
+        while True:
+            try:
+                self.queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:  # keep waiting, unless the writer thread has stopped
+                if self.error is not None:
+                    return False
+
+    def run(self):
+        writer = self.writer
+        batch = []
+        try:
+            while True:
+                item = self.queue.get()
+                deadline = time.monotonic() + self.flushInterval
+                # collect a batch: until it is full, the deadline passes, or a status message / the end comes up
+                while item is not None and item[1] is None:
+                    batch.append(item[0])
+                    if len(batch) >= self.batchSize:
+                        break
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = self.queue.get(timeout=timeout)
+                    except queue.Empty:
+                        break
+                else:
+                    if batch:
+                        writer.emit_batch(batch)
+                        batch = []
+                    if item is None:
+                        writer.flush()
+                        return
+                    writer.status(item[1])
+                    continue
+                writer.emit_batch(batch)
+                writer.flush()
+                batch = []
+        except Exception as e:  # e.g. the consumer of a pipe went away, the next write raises it
+            self.error = e
+
+    def close(self):
+        # write what is queued and stop the thread
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self.check()
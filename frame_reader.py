@@ -0,0 +1,267 @@
+import binascii
+import threading
+import time
+from collections import deque
+
+import frame_data as fd
+import metrics
+
+CHUNK_SIZE = 65536  # max. no. octets requested per read
+RING_CAPACITY = 1 << 22  # max. no. octets read by a ReaderThread and waiting to be decoded
+# what to do with a frame that fails the FCS check: still yield it with fcsValid = False, or drop it before decoding
+FCS_CHECKS = ("flag", "drop")
+
+def read_function(source):
+    # pick the bulk read call of the source, and whether an empty read means there is no more data
+    if hasattr(source, "buffer"):  # text file / stdin, read the underlying bytes
+        source = source.buffer
+    if hasattr(source, "recv"):  # socket
+        return source.recv, True
+    if hasattr(source, "in_waiting"):  # serial port, an empty read is a timeout
+        def read(size):
+            # take whatever the driver has buffered, or block for 1 octet (until the timeout)
+            return source.read(min(max(source.in_waiting, 1), size))
+        return read, False
+    if hasattr(source, "read1"):  # buffered file / pipe, return what is available instead of waiting for size octets
+        return source.read1, True
+    return source.read, True
+
+def timed(function, m, stage):
+    # function that adds the time of each call to a stage of the metrics
+    clock = time.perf_counter
+    def call(*args):
+        start = clock()
+        result = function(*args)
+        m.observe(stage, clock() - start)
+        return result
+    return call
+
+def counted(callback, m, name):
+    # callback that also counts its calls in the metrics (None: only counts them)
+    def call(*args):
+        m.add(name)
+        if callback is not None:
+            callback(*args)
+    return call
+
+class TimedFilter:
+    # frame filter that times its checks and counts the frames it skips
+    def __init__(self, frame_filter, m):
+        self.frameFilter = frame_filter
+        self.metrics = m
+
+    def matches(self, raw):
+        start = time.perf_counter()
+        matched = self.frameFilter.matches(raw)
+        self.metrics.observe("filter", time.perf_counter() - start)
+        if not matched:
+            self.metrics.add("filtered")
+        return matched
+
+def read_lines(source, chunk_size=CHUNK_SIZE, on_timeout=None):
+    # yield (time.time() of the read, lines completed by it) for each read of a byte source, reading it in large chunks
+    read, empty_is_eof = read_function(source)
+    m = metrics.METRICS
+    if m is not None:
+        read = timed(read, m, "read")
+    pending = b""  # incomplete line at the end of the last chunk
+    while True:
+        chunk = read(chunk_size)
+        timestamp = time.time()
+        if not chunk:
+            if empty_is_eof:
+                break
+            if on_timeout is not None:
+                on_timeout()
+            continue
+        if m is not None:
+            start = time.perf_counter()
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        if m is not None:
+            m.observe("framing", time.perf_counter() - start)
+            m.add("lines", len(lines))
+        yield timestamp, lines
+    if pending:
+        yield time.time(), [pending]
+
+class ReaderThread:
+    # reads a source from its own thread, so the port is drained while frames are decoded
+    # each read is split into lines right away, the complete lines wait in a ring buffer of up to capacity octets
+    # with the monotonic time of the read they were completed by; when the ring is full, the lines read are dropped
+    # and counted (an overrun) instead of holding up reading, which would overflow the driver's buffer
+    def __init__(self, source, chunk_size=CHUNK_SIZE, capacity=RING_CAPACITY):
+        self.read, self.emptyIsEof = read_function(source)
+        self.chunkSize = chunk_size
+        self.capacity = capacity
+        self.batches = deque()  # (receive time, timestamp, lines or None for a read timeout, no. octets), oldest first
+        self.backlog = 0  # no. octets in the ring, read and not decoded yet
+        self.ready = threading.Condition()
+        self.done = False  # source closed
+        self.error = None  # exception that stopped reading, raised by iter_batches()
+        # stats
+        self.octetsRead = 0
+        self.linesRead = 0
+        self.overruns = 0  # reads whose lines were dropped
+        self.droppedLines = 0
+        self.peakBacklog = 0  # no. octets
+        self.peakRead = 0  # largest read, what the driver had buffered
+        self.metrics = metrics.METRICS
+        self.thread = threading.Thread(target=self.run, name="sniffer-reader", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def run(self):
+        read = self.read
+        m = self.metrics
+        if m is not None:
+            read = timed(read, m, "read")
+        pending = b""  # incomplete line at the end of the last read
+        try:
+            while not self.done:
+                chunk = read(self.chunkSize)
+                now = time.monotonic()
+                timestamp = time.time()
+                if not chunk:
+                    if self.emptyIsEof:
+                        break
+                    self.push(now, timestamp, None, 0)
+                    continue
+                self.octetsRead += len(chunk)
+                self.peakRead = max(self.peakRead, len(chunk))
+                if m is not None:
+                    start = time.perf_counter()
+                lines = (pending + chunk).split(b"\n")
+                pending = lines.pop()
+                if m is not None:
+                    m.observe("framing", time.perf_counter() - start)
+                    m.add("lines", len(lines))
+                if lines:
+                    self.push(now, timestamp, lines, sum(map(len, lines)) + len(lines))
+            if pending:
+                self.push(time.monotonic(), time.time(), [pending], len(pending))
+        except Exception as e:  # e.g. the port went away
+            self.error = e
+        finally:
+            with self.ready:
+                self.done = True
+                self.ready.notify()
+
+    def push(self, now, timestamp, lines, num_octets):
+        with self.ready:
+            if lines is not None:
+                self.linesRead += len(lines)
+                if self.backlog + num_octets > self.capacity:  # the decoder is too far behind
+                    self.overruns += 1
+                    self.droppedLines += len(lines)
+                    if self.metrics is not None:
+                        self.metrics.add("overrun_lines", len(lines))
+                    return
+            self.batches.append((now, timestamp, lines, num_octets))
+            self.backlog += num_octets
+            self.peakBacklog = max(self.peakBacklog, self.backlog)
+            self.ready.notify()
+        if self.metrics is not None:
+            self.metrics.set("reader_backlog", self.backlog)
+
+    def iter_batches(self, on_timeout=None):
+        # yield (receive time, timestamp, lines) for each read, until the source is closed
+        # and every line is yielded
+        while True:
+            with self.ready:
+                while not self.batches and not self.done:
+                    self.ready.wait()
+                if not self.batches:
+                    break
+                batches, self.batches = self.batches, deque()  # take every batch waiting in one go
+            for receive_time, timestamp, lines, num_octets in batches:
+                if lines is None:
+                    if on_timeout is not None:
+                        on_timeout()
+                    continue
+                yield receive_time, timestamp, lines
+                # the batch's lines are decoded: they leave the ring only now, until then they count in the backlog
+                with self.ready:
+                    self.backlog -= num_octets
+                if self.metrics is not None:
+                    self.metrics.set("reader_backlog", self.backlog)
+        if self.error is not None:
+            raise self.error
+
+    def stats(self):
+        return {"octetsRead": self.octetsRead, "linesRead": self.linesRead, "overruns": self.overruns, "droppedLines": self.droppedLines,
+                "backlog": self.backlog, "peakBacklog": self.peakBacklog, "capacity": self.capacity, "peakRead": self.peakRead}
+
+    def to_string(self):
+        return "Reader: {0} octets, {1} lines, peak backlog {2} octets ({3:.1f}% of the ring), largest read {4} octets, {5} overruns ({6} lines dropped)".format(
+            self.octetsRead, self.linesRead, self.peakBacklog, 100 * self.peakBacklog / self.capacity, self.peakRead, self.overruns, self.droppedLines)
+
+def frame_gate(fcs_check=None, on_bad_fcs=None, frame_filter=None, on_error=None):
+    # function turning a raw frame into a FrameData (tagged with its source), or None if it is dropped:
+    # a frame shorter than its FC and FCS (e.g. a noisy line) is malformed, on_error is called with its hex
+    # fcs_check ("flag" or "drop", see FCS_CHECKS) verifies the FCS, on_bad_fcs is called with the raw frame that failed
+    # frame_filter (frame_filter.FrameFilter) drops the frames it does not match, before decoding them
+    # with metrics enabled, the FCS check and filter are timed and what they reject is counted
+    check_fcs = fd.fcs_valid
+    m = metrics.METRICS
+    if m is not None:
+        on_bad_fcs = counted(on_bad_fcs, m, "bad_fcs")
+        check_fcs = timed(fd.fcs_valid, m, "fcs")
+        if frame_filter is not None:
+            frame_filter = TimedFilter(frame_filter, m)
+
+    def gate(raw, source=None):
+        if len(raw) < fd.MIN_FRAME_LENGTH:
+            if on_error is not None:
+                on_error(raw.hex())
+            return None
+        if fcs_check is not None:
+            valid = check_fcs(raw)
+            if not valid:
+                if on_bad_fcs is not None:
+                    on_bad_fcs(raw)
+                if fcs_check == "drop":  # corrupt frame, skip decoding it
+                    return None
+        if frame_filter is not None and not frame_filter.matches(raw):
+            return None
+        frame = fd.FrameData(raw, source)
+        if fcs_check is not None:
+            frame.fcsValid = valid
+        return frame
+    return gate
+
+def iter_frames(source, chunk_size=CHUNK_SIZE, on_timeout=None, on_error=None, fcs_check=None, on_bad_fcs=None, frame_filter=None, name=None):
+    # yield a FrameData for each line of hex characters sent by the sniffer, tagged with name (e.g. the port) as its source
+    # source can be a serial port, socket, pipe or any file-like object, or a started ReaderThread reading one,
+    # in which case each frame also gets the monotonic time it was read (receiveTime)
+    # each frame gets the wall-clock time of the read that completed its line (timestamp)
+    # on_error is called with each malformed line (str): not hex, or too short to be a frame
+    # fcs_check ("flag" or "drop", see FCS_CHECKS) verifies the FCS of each frame, on_bad_fcs is called with the raw frame that failed
+    # frame_filter (frame_filter.FrameFilter) skips the frames it does not match, before decoding them
+    # with metrics enabled, malformed lines are counted, see frame_gate for the rest
+    if metrics.METRICS is not None:
+        on_error = counted(on_error, metrics.METRICS, "malformed")
+    gate = frame_gate(fcs_check, on_bad_fcs, frame_filter, on_error)
+    if isinstance(source, ReaderThread):
+        batches = source.iter_batches(on_timeout)
+    else:
+        batches = ((None, timestamp, lines) for timestamp, lines in read_lines(source, chunk_size, on_timeout))
+    for receive_time, timestamp, lines in batches:
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                raw = binascii.unhexlify(line)
+            except ValueError:  # not hex, or cut in the middle of an octet
+                if on_error is not None:
+                    on_error(line.decode("ascii", "replace"))
+                continue
+            frame = gate(raw, name)
+            if frame is None:
+                continue
+            frame.receiveTime = receive_time
+            frame.timestamp = timestamp
+            yield frame
@@ -1,84 +1,139 @@
-def octets_to_binary(hex, num_octets, endianness):
-    base = 16  # hexadecimal
-    #num_of_bits = num_octets * 8
-    #return bin(int(fc, base))[2:].zfill(num_of_bits)
+import binascii
+import struct
 
-    bin_str = ""
-    # NOTE: 'endianness' isn't the best term to use here
+# precompiled little-endian layouts for the common field widths (no. octets -> layout)
+UINT_LE = {1: struct.Struct("<B"), 2: struct.Struct("<H"), 4: struct.Struct("<I"), 8: struct.Struct("<Q")}
+
+def unpack_uint(buf, start, num_octets, endianness="big"):
+    # read num_octets from a bytes/memoryview as an unsigned int, in the given octet order
+    stop = start + num_octets
     if endianness == "little":
-        for i in reversed(range(num_octets)):
-            bin_str += octet_to_binary(hex[i*2:(i+1)*2]) #, endianness)
-    else: # endianness == "big":
-        for i in range(num_octets):
-            bin_str += octet_to_binary(hex[i*2:(i+1)*2]) #, endianness)
-        
-    return bin_str
-
-def binary_to_octets():
-    pass
-
-def octet_to_binary(hex): #, endianness):
-    base = 16  # hexadecimal
-    num_of_bits = 8
-    return bin(int(hex, base))[2:].zfill(num_of_bits)
-    
-def slice_bits(bin_str, start, stop, num_bits, flip_bit_idx=False):
-    if flip_bit_idx: # bit [0] is at [len-1]
-        idx_start = num_bits - start
-        idx_stop = num_bits - stop - 1
-        return bin_str[idx_stop:idx_start]
-    else:  # start and stop inclusive
-        return bin_str[start:stop+1]
-
-def slice_octets(hex_str, start, num_octets, endianness="big"):
-    # one octet is 2 hex characters
-    if endianness == "big":
-        start_idx = start*2
-        stop_idx = start_idx + num_octets*2
-        return hex_str[start_idx:stop_idx]
-    elif endianness == "little":
-        sliced = ""
-        for i in reversed(range(num_octets)):
-            sliced += hex_str[(start+i)*2 : (start+i+1)*2]
-        return sliced
-    else:
+        layout = UINT_LE.get(num_octets)
+        if layout is not None and stop <= len(buf):
+            return layout.unpack_from(buf, start)[0]
+    elif endianness != "big":
         raise NotImplementedError()
+    return int.from_bytes(buf[start:stop], endianness)
+
+# octet -> same octet with its bit order reversed
+BIT_REVERSED = bytes(int("{0:08b}".format(i)[::-1], 2) for i in range(256))
+
+def fcs16(buf):
+    # IEEE 802.15.4 FCS: CRC-16 ITU-T (x^16 + x^12 + x^5 + 1), initial value 0, computed LSB first
+    # binascii.crc_hqx (C) computes the same CRC MSB first, so it is given bit-reversed octets and its result is reversed back
+    crc = binascii.crc_hqx(bytes(buf).translate(BIT_REVERSED), 0)
+    return (BIT_REVERSED[crc & 0xff] << 8) | BIT_REVERSED[crc >> 8]
+
+def escape(text):
+    # literal text in a str.format string
+    return text.replace("{", "{{").replace("}", "}}")
+
+def record_value(field):
+    # plain value of a decoded field, as stored in records (None if not present)
+    if field is None:
+        return None
+    if isinstance(field, list):
+        return tuple(item.get_data() for item in field)
+    return field.get_data()
+
+def fields_to_dict(obj, names):
+    # plain values of the named fields of a decoded object
+    return {name: record_value(getattr(obj, name)) for name in names}
+
+class LazyField:
+    # decorator for a field that is decoded on first access, the result is then cached in the instance
+    # (same idea as functools.cached_property, without its per-access locking)
+    def __init__(self, decode):
+        self.decode = decode
+        self.name = decode.__name__
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        value = obj.__dict__[self.name] = self.decode(obj)
+        return value
 
 class Bits:
-    def __init__(self, bits):
-        self.data = bits
-        self.length = len(bits)
+    # bit field kept as an int, rendered as a binary string on demand
+    __slots__ = ("value", "length")
+
+    def __init__(self, value, length):
+        self.value = value
+        self.length = length  # no. bits
+
+    @property
+    def data(self):
+        if not self.length:
+            return ""
+        return "{0:0{1}b}".format(self.value, self.length)
 
     def to_string(self):
-        return "{0}'b{1}".format(self.length, self.data)
+        return "%d'b%s" % (self.length, self.data)
 
 class BitFlag:
-    def __init__(self, bit, name):
-        self.data = Bits(bit)
+    __slots__ = ("value", "name")
+
+    def __init__(self, bit, name):  # bit is 0/1
+        self.value = bool(bit)
         self.name = name
-        self.value = False if (bit == "0") else True
+
+    @property
+    def data(self):
+        return Bits(int(self.value), 1)
 
     def get_data(self):
         return self.value
 
     def to_string(self):
-        return "{0}: {1} ({2})".format(self.name, self.value, self.data.to_string())
+        return "%s: %s (1'b%d)" % (self.name, self.value, self.value)  # as data.to_string()
 
 class OctetData:
-    def __init__(self, octets, name, is_bits, endianness="little"):
-        self.data = octets
-        self.length = len(octets) // 2  # no. octets
+    # octets kept as an unsigned int in display order, the hex and binary strings are rendered on demand
+    __slots__ = ("octets", "length", "name", "isBits", "endianness")
+
+    def __init__(self, octets, length, name, is_bits, endianness="little"):
+        self.octets = octets
+        self.length = length  # no. octets
         self.name = name
         self.isBits = is_bits
-        if is_bits:
-            # NOTE: 'endianness' here might overlap with the typical input for octets, which is slice_octets
-            self.bin = Bits(octets_to_binary(octets, self.length, endianness))
+        # NOTE: 'endianness' is the octet order of the binary string ("little": it starts from the last octet)
+        self.endianness = endianness
+
+    @classmethod
+    def from_buffer(cls, buf, start, num_octets, name, is_bits, endianness="little", byte_order="big"):
+        # read num_octets from a bytes/memoryview, byte_order as for unpack_uint
+        stop = start + num_octets
+        if stop > len(buf):  # truncated data, keep what there is
+            num_octets = max(len(buf) - start, 0)
+        elif byte_order == "little" and num_octets in UINT_LE:  # common field widths
+            return cls(UINT_LE[num_octets].unpack_from(buf, start)[0], num_octets, name, is_bits, endianness)
+        return cls(unpack_uint(buf, start, num_octets, byte_order), num_octets, name, is_bits, endianness)
+
+    @property
+    def data(self):
+        if not self.length:
+            return ""
+        return "%0*x" % (self.length*2, self.octets)
+
+    @property
+    def bin(self):
+        value = self.octets
+        if self.endianness == "little":  # binary string starts from the last octet
+            value = int.from_bytes(value.to_bytes(self.length, "big"), "little")
+        return Bits(value, self.length*8)
 
     def get_data(self):
-        return self.data.to_string()
+        return self.data
 
     def to_string(self):
-        to_str = "{0}: 0x{1}".format(self.name, self.data)
+        # same text as from data and bin, formatted in place
+        length = self.length
+        if not length:
+            return self.name + (": 0x (0'b)" if self.isBits else ": 0x")
+        to_str = "%s: 0x%0*x" % (self.name, length*2, self.octets)
         if self.isBits:
-            to_str += " ({})".format(self.bin.to_string())
+            value = self.octets
+            if self.endianness == "little":  # binary string starts from the last octet
+                value = int.from_bytes(value.to_bytes(length, "big"), "little")
+            to_str += " (%d'b%s)" % (length*8, format(value, "0%db" % (length*8)))
         return to_str
@@ -0,0 +1,209 @@
+import time
+
+import message_payload as mp
+import metrics
+
+# Per-node sequence gaps and packet loss, fed with decoded frames
+# Each node is tracked on two 8-bit sequence numbers: the MAC header's (every frame it sends) and, for tags, the TWR
+# sequence number of its group polls. A gap in a sequence is a run of frames lost, by the sniffer or in the network.
+# The state of a sequence has a fixed size: the last WINDOW sequence numbers as a bitmask (1 = received), from which
+# the loss rate and burst lengths over that window are read, and exponentially weighted averages of the inter-arrival
+# time and its jitter (RFC 3550 style), so memory does not grow over a long run.
+
+SEQUENCE_MODULUS = 256  # both sequence numbers are one octet
+WINDOW = 256  # sequence numbers the loss rate and bursts are computed over
+JITTER_GAIN = 1 / 16  # weight of a new inter-arrival sample, as RTP's jitter estimate
+
+class SequenceStats:
+    __slots__ = ("window", "last", "received", "mask", "filled", "lost", "duplicates", "reordered", "resyncs", "lastBurst",
+                 "maxBurst", "lastTime", "interval", "jitter")
+
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self.last = None  # last sequence number, the newest of the window
+        self.received = 0
+        self.mask = 0  # bit i for sequence number last - i, set if received
+        self.filled = 0  # sequence numbers in the window so far (up to window)
+        self.lost = 0  # since the start, frames received late are taken off again
+        self.duplicates = 0  # same sequence number again (e.g. heard by another sniffer)
+        self.reordered = 0  # received after a later sequence number
+        self.resyncs = 0  # restarts after a silence too long to tell the gap from the sequence number
+        self.lastBurst = 0  # frames lost in the last gap
+        self.maxBurst = 0
+        self.lastTime = None
+        self.interval = None  # average time (s) per sequence number step
+        self.jitter = 0.0  # average deviation (s) of the interval
+
+    def update(self, sequence, now):
+        if self.last is None or (self.interval is not None and now - self.lastTime > self.interval * SEQUENCE_MODULUS / 2):
+            # first frame, or silent for over half a sequence cycle (e.g. a reboot): restart the window from it
+            if self.last is not None:
+                self.resyncs += 1
+            self.last = sequence
+            self.received += 1
+            self.mask = 1
+            self.filled = 1
+            self.lastTime = now
+            return
+        step = (sequence - self.last) % SEQUENCE_MODULUS
+        if step == 0:
+            self.duplicates += 1
+            return
+        if step >= SEQUENCE_MODULUS // 2:  # behind the last one: late, unless already received
+            behind = SEQUENCE_MODULUS - step
+            if behind < self.filled and not self.mask >> behind & 1:
+                self.mask |= 1 << behind
+                self.received += 1
+                self.lost -= 1
+                self.reordered += 1
+            else:
+                self.duplicates += 1
+            return
+        gap = step - 1  # sequence numbers skipped
+        self.mask = (self.mask << step | 1) & ((1 << self.window) - 1)
+        self.filled = min(self.filled + step, self.window)
+        self.received += 1
+        if gap:
+            self.lost += gap
+            self.lastBurst = gap
+            if gap > self.maxBurst:
+                self.maxBurst = gap
+        # inter-arrival time per step, so that a gap does not count as jitter
+        interval = (now - self.lastTime) / step
+        if self.interval is None:
+            self.interval = interval
+        else:
+            self.jitter += (abs(interval - self.interval) - self.jitter) * JITTER_GAIN
+            self.interval += (interval - self.interval) * JITTER_GAIN
+        self.last = sequence
+        self.lastTime = now
+
+    def window_bits(self):
+        # received (1) / lost (0) over the window, oldest first
+        return format(self.mask, "0{}b".format(self.filled)) if self.filled else ""
+
+    def loss_rate(self):
+        # fraction of the window's sequence numbers lost
+        if not self.filled:
+            return 0.0
+        return 1 - bin(self.mask).count("1") / self.filled
+
+    def bursts(self):
+        # lengths of the runs of frames lost in the window, oldest first
+        return [len(run) for run in self.window_bits().split("1") if run]
+
+    def to_dict(self):
+        bursts = self.bursts()
+        return {"last": self.last, "received": self.received, "lost": self.lost, "duplicates": self.duplicates,
+                "reordered": self.reordered, "resyncs": self.resyncs, "lossRate": self.loss_rate(), "bursts": len(bursts),
+                "meanBurst": sum(bursts) / len(bursts) if bursts else 0.0, "windowMaxBurst": max(bursts, default=0),
+                "lastBurst": self.lastBurst, "maxBurst": self.maxBurst, "interval": self.interval, "jitter": self.jitter}
+
+class NodeLoss:
+    __slots__ = ("address", "source", "mac", "twr")
+
+    def __init__(self, address, source, window):
+        self.address = address  # as in the MAC header (hex)
+        self.source = source  # sniffer, if tracked per sniffer
+        self.mac = SequenceStats(window)  # MAC header sequence number
+        self.twr = None  # TWR sequence number of its group polls (tags), None until one is received
+
+    def to_dict(self):
+        return {"address": self.address, "source": self.source, "mac": self.mac.to_dict(),
+                "twr": None if self.twr is None else self.twr.to_dict()}
+
+class LossTracker:
+    def __init__(self, window=WINDOW, per_sniffer=False):
+        self.window = window
+        # per_sniffer: track the frames of each sniffer separately (what a sniffer misses), otherwise what all of
+        # them together miss (a frame heard by several sniffers is a duplicate)
+        self.perSniffer = per_sniffer
+        self.nodes = {}  # address, or (sniffer, address) -> NodeLoss
+
+    def update(self, frame, now=None):
+        # update the node that sent one FrameData, now is its receive time (the reader's, the one recorded with
+        # the frame, or time.monotonic())
+        header = frame.macHeader
+        if header.srcAddr is None:
+            return
+        if now is None:
+            if frame.receiveTime is not None:
+                now = frame.receiveTime
+            elif frame.timestamp is not None:
+                now = frame.timestamp
+            else:
+                now = time.monotonic()
+        address = header.srcAddr.get_data()
+        key = (frame.source, address) if self.perSniffer else address
+        node = self.nodes.get(key)
+        if node is None:
+            node = self.nodes[key] = NodeLoss(address, frame.source if self.perSniffer else None, self.window)
+        node.mac.update(header.sequenceNumber.octets, now)
+        for msg in frame.payload.messages:
+            if type(msg) is mp.MsgGroupPoll:
+                if node.twr is None:
+                    node.twr = SequenceStats(self.window)
+                node.twr.update(msg.sequenceNumber.octets, now)
+
+    def snapshot(self):
+        # key -> node dict, the index is copied in one step so updates go on meanwhile (as NetworkState.snapshot)
+        return {key: node.to_dict() for key, node in self.nodes.copy().items()}
+
+    def worst(self, count=3):
+        # nodes with the highest MAC loss rate over the window
+        return sorted(self.nodes.copy().values(), key=lambda node: node.mac.loss_rate(), reverse=True)[:count]
+
+    def totals(self):
+        # frames received and lost over all nodes, MAC and TWR sequences
+        totals = {"nodes": 0, "received": 0, "lost": 0, "twrReceived": 0, "twrLost": 0}
+        for node in self.nodes.copy().values():
+            totals["nodes"] += 1
+            totals["received"] += node.mac.received
+            totals["lost"] += node.mac.lost
+            if node.twr is not None:
+                totals["twrReceived"] += node.twr.received
+                totals["twrLost"] += node.twr.lost
+        return totals
+
+    def to_string(self, count=3):
+        # one line summary: loss since the start over all nodes, then the nodes losing the most over the window
+        totals = self.totals()
+        def percent(lost, received):
+            return 100 * lost / (lost + received) if lost + received else 0.0
+        line = "loss: {0} nodes, MAC {1} lost ({2:.2f}%), TWR {3} lost ({4:.2f}%)".format(
+            totals["nodes"], totals["lost"], percent(totals["lost"], totals["received"]),
+            totals["twrLost"], percent(totals["twrLost"], totals["twrReceived"]))
+        worst = [node for node in self.worst(count) if node.mac.loss_rate() > 0]
+        if worst:
+            line += " | worst: " + ", ".join("{0}{1} {2:.1f}% (burst {3}, jitter {4:.1f} ms)".format(
+                node.address, "" if node.source is None else "@{}".format(node.source), 100 * node.mac.loss_rate(),
+                max(node.mac.bursts(), default=0), 1e3 * node.mac.jitter) for node in worst)
+        return line
+
+    def publish(self, metrics):
+        # per-node gauges for the metrics endpoint (a Metrics collector)
+        for node in self.nodes.copy().values():
+            labels = (("node", node.address),) if node.source is None else (("node", node.address), ("source", node.source))
+            for sequence, stats in (("mac", node.mac), ("twr", node.twr)):
+                if stats is not None:
+                    metrics.set("node_loss_ratio", stats.loss_rate(), labels + (("sequence", sequence),))
+            metrics.set("node_jitter_seconds", node.mac.jitter, labels)
+
+class LossWriter:
+    # wraps a frame_output writer, also tracks the loss of each frame written
+    def __init__(self, writer, tracker):
+        self.writer = writer
+        self.tracker = tracker
+
+    def format(self, frame):
+        metrics.timed_track(self.tracker.update, frame)
+        return self.writer.format(frame)
+
+    def emit(self, data):
+        self.writer.emit(data)
+
+    def write(self, frame):
+        self.emit(self.format(frame))
+
+    def status(self, message):
+        self.writer.status(message)
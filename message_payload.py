@@ -1,598 +1,682 @@
-from helper import octets_to_binary, slice_bits, slice_octets, Bits, BitFlag, OctetData
+from helper import unpack_uint, record_value, escape, BitFlag, OctetData, LazyField
 
 import struct
+from collections import OrderedDict
+
+# message ID octet -> message class, filled in at import by @register_message
+MSG_DECODERS = {}
+
+def register_message(msgType):
+    msg_id = int(msgType.MSG_ID, 16)
+    if msg_id in MSG_DECODERS:
+        raise ValueError("Message ID {0} is already registered to {1}".format(msgType.MSG_ID, MSG_DECODERS[msg_id].__name__))
+    MSG_DECODERS[msg_id] = msgType
+    return msgType
+
+# precompiled layouts for numeric fields
+INT8 = struct.Struct("b")
+UINT8 = struct.Struct("B")  # counts
+INT16_LE = struct.Struct("<h")
+FLOAT_LE = struct.Struct("<f")
 
 class NumData(OctetData):
-    # NOTE: the endianness here refers to decoding the bits MSB or LSB first, and not how to unpack the data
-    def __init__(self, octets, name, unpack_format, endianness="little"):
-        super().__init__(octets, name, False, endianness)
+    __slots__ = ("value",)
+
+    def __init__(self, data, start, name, layout):
+        # octets are kept in the order they were sent, the layout decides how to unpack them
+        super().__init__(unpack_uint(data, start, layout.size), layout.size, name, False)
         # compute value
-        self.value = struct.unpack(unpack_format, bytes(bytearray.fromhex(octets)) )[0]
+        self.value = layout.unpack_from(data, start)[0]
+
+    @classmethod
+    def from_value(cls, value, octets, length, name):
+        # already unpacked (e.g. by a message LAYOUT)
+        num_data = cls.__new__(cls)
+        OctetData.__init__(num_data, octets, length, name, False)
+        num_data.value = value
+        return num_data
     
+    # Override
+    def get_data(self):
+        return self.value
+
     # Override
     def to_string(self):
-        to_str = "{0}: {1} (0x{2})".format(self.name, self.value, self.data)
-        return to_str
+        return "%s: %s (0x%0*x)" % (self.name, self.value, self.length*2, self.octets)
 
-class MsgBeacon:
-    VARIABLE_LENGTH = False
-    LENGTH = 23
-    MSG_ID = "10"
-    MSG_ID_NAME = "UWBMAC_FRM_TYPE_BCN"
-    def __init__(self, data):
-        # decode payload
-        self.sessionId = OctetData(slice_octets(data, 1, 1, endianness="little"), "Session ID", False)
-        self.clusterFlags = OctetData(slice_octets(data, 2, 2, endianness="little"), "Cluster Flags", True, endianness="big")
-        self.sfNumber = OctetData(slice_octets(data, 4, 2, endianness="little"), "Superframe Number", False)
-        self.clusterSlotNumber = OctetData(slice_octets(data, 6, 1, endianness="little"), "Cluster Slot Number", False)
-        self.clusterMap = OctetData(slice_octets(data, 7, 4, endianness="little"), "Cluster Map", True, endianness="big")
-        self.dataSlotMap = OctetData(slice_octets(data, 11, 2, endianness="little"), "Data Slot Map", True)
-        self.nonce = OctetData(slice_octets(data, 13, 10, endianness="little"), "NONCE", False)
-        # store message data
-        self.data = OctetData(slice_octets(data, 0, self.LENGTH, endianness="big"), "Beacon Message", False)
-        self.length = self.LENGTH  # no. octets
+# DW1000 system time counts ticks of 1/(128*499.2 MHz), about 15.65 ps, in a 40-bit counter
+DW1000_TICK = 1 / (128 * 499.2e6)  # s
+DW1000_TIMESTAMP_BITS = 40
 
-    def to_string(self):
-        return self.data.to_string()  # Beacon message data
+class Timestamp(OctetData):
+    # DW1000 timestamp, messages may only carry its lower octets
+    __slots__ = ()
 
-    def data_breakdown(self, num_spaces):
-        start_spacing = ""
-        for i in range(num_spaces):
-            start_spacing += "  "
-        indented = start_spacing + "  "
-        data_str = ""
-        # Message metadata
-        data_str += start_spacing + self.data.to_string() + " - "   # Beacon message
-        data_str += "Length: " + str(self.length) + "\n"    # Beacon message length
-        data_str += indented + "Message ID: {0} ({1})".format(self.MSG_ID, self.MSG_ID_NAME) + "\n"  # Message ID
-        # Message contents
-        data_str += indented + self.sessionId.to_string() + "\n"  # Session ID
-        data_str += indented + self.clusterFlags.to_string() + "\n"  # Cluster Flags
-        data_str += indented + self.sfNumber.to_string() + "\n"  # Superframe (SF) Number
-        data_str += indented + self.clusterSlotNumber.to_string() + "\n"  # Cluster Slot Number
-        data_str += indented + self.clusterMap.to_string() + "\n"  # Cluster Map
-        data_str += indented + self.dataSlotMap.to_string() + "\n"  # Data Slot Map
-        data_str += indented + self.nonce.to_string() + "\n"  # NONCE
-        # return data
-        return data_str
+    @property
+    def ticks(self):
+        return self.octets
+
+    @property
+    def seconds(self):
+        return self.octets * DW1000_TICK
+
+    # Override
+    def to_string(self):
+        return "{0}: 0x{1} ({2:.3f} us)".format(self.name, self.data, self.seconds * 1e6)
+
+# Message schemas
+# Each message class lists its fields in SCHEMA, in message order. When the class is defined, the schema is compiled into:
+# - a descriptor per field, decoding it on first access (as LazyField)
+# - one struct.Struct (LAYOUT) unpacking every fixed-size field at once, for to_record / to_dict / data_breakdown
+# - the message length, read from the count field of the variable-length part (if any)
+# - the data_breakdown text as one format string (BREAKDOWN), filled in from the LAYOUT values
+# Fields the layout cannot hold (bit flags sharing an octet, the variable-length part) and truncated messages
+# are decoded field by field: a field cut off keeps the octets there are (OctetField, ArrayField), a number or
+# a flag past the end of the message is None.
+
+UINT_CODES = {1: "B", 2: "H", 4: "I", 8: "Q"}
+
+class Field:
+    # one field of a message schema, and the descriptor decoding it on first access
+    __slots__ = ("name", "offset", "size", "label")
+    code = None  # struct format of the field in the message LAYOUT, None if it is decoded on its own
+
+    def line(self):
+        # format string of the field's data_breakdown line, as its to_string(), None if it has none
+        return None
+
+    def __get__(self, msg, msgType=None):
+        if msg is None:
+            return self
+        value = msg.__dict__[self.name] = self.decode(msg)
+        return value
+
+class OctetField(Field):
+    # octets read in little endian into an OctetData (or a subclass of it, e.g. Timestamp)
+    __slots__ = ("isBits", "endianness", "octetType", "code")
+
+    def __init__(self, name, offset, size, label, is_bits=False, endianness="little", octetType=OctetData):
+        self.name = name
+        self.offset = offset
+        self.size = size
+        self.label = label
+        self.isBits = is_bits
+        self.endianness = endianness  # of the binary string, as for OctetData
+        self.octetType = octetType
+        self.code = UINT_CODES.get(size, "{}s".format(size))
+
+    def decode(self, msg):
+        return self.octetType.from_buffer(msg.raw, self.offset, self.size, self.label, self.isBits, self.endianness, byte_order="little")
+
+    def build(self, msg, value):
+        # from the value unpacked by the LAYOUT
+        if isinstance(value, bytes):
+            value = int.from_bytes(value, "little")
+        return self.octetType(value, self.size, self.label, self.isBits, self.endianness)
+
+    def plain(self, msg, value):
+        # record value (hex string), without building the OctetData
+        if isinstance(value, bytes):
+            value = int.from_bytes(value, "little")
+        return "%0*x" % (self.size*2, value)
+
+    def line(self):
+        fmt = escape(self.label) + ": 0x{}"
+        if issubclass(self.octetType, Timestamp):
+            return fmt + " ({:.3f} us)"
+        if self.isBits:
+            return fmt + " ({}'b{{}})".format(self.size*8)
+        return fmt
+
+    def line_args(self, msg, value):
+        # arguments of line(), from the value unpacked by the LAYOUT
+        if isinstance(value, bytes):
+            value = int.from_bytes(value, "little")
+        hex_str = "%0*x" % (self.size*2, value)
+        if issubclass(self.octetType, Timestamp):
+            return hex_str, value * DW1000_TICK * 1e6
+        if self.isBits:
+            if self.endianness == "little":  # binary string starts from the last octet
+                value = int.from_bytes(msg.raw[self.offset:self.offset+self.size], "big")
+            return hex_str, "{0:0{1}b}".format(value, self.size*8)
+        return (hex_str,)
+
+class NumField(Field):
+    # number unpacked with a struct layout into a NumData
+    __slots__ = ("layout", "code")
+
+    def __init__(self, name, offset, layout, label):
+        self.name = name
+        self.offset = offset
+        self.size = layout.size
+        self.label = label
+        self.layout = layout
+        self.code = layout.format.lstrip("<")
+
+    def decode(self, msg):
+        if self.offset + self.size > len(msg.raw):  # truncated message
+            return None
+        return NumData(msg.raw, self.offset, self.label, self.layout)
+
+    def build(self, msg, value):
+        return NumData.from_value(value, unpack_uint(msg.raw, self.offset, self.size), self.size, self.label)
+
+    def plain(self, msg, value):
+        return value
+
+    def line(self):
+        return escape(self.label) + ": {} (0x{})"
+
+    def line_args(self, msg, value):
+        return value, msg.raw[self.offset:self.offset+self.size].hex()
+
+class FlagField(Field):
+    # one bit of an octet (bit 0 is the LSB), into a BitFlag
+    __slots__ = ("bit",)
+
+    def __init__(self, name, offset, bit, label):
+        self.name = name
+        self.offset = offset
+        self.size = 1
+        self.label = label
+        self.bit = bit
+
+    def decode(self, msg):
+        if self.offset >= len(msg.raw):  # truncated message
+            return None
+        return BitFlag(msg.raw[self.offset] >> self.bit & 1, self.label)
+
+    def line(self):
+        return escape(self.label) + ": {} (1'b{})"
+
+    def line_args(self, msg, value):
+        # not in the LAYOUT, read from the octet
+        bit = msg.raw[self.offset] >> self.bit & 1
+        return bool(bit), bit
+
+class ArrayField(Field):
+    # variable-length part: count (the value of the count field) items of itemSize octets, read as OctetField does
+    # with an item label, a list of OctetData (label formatted with the item index), otherwise one OctetData
+    __slots__ = ("count", "itemSize", "itemLabel")
+
+    def __init__(self, name, offset, label, count, itemSize=1, itemLabel=None):
+        self.name = name
+        self.offset = offset
+        self.size = None  # known once the count is decoded
+        self.label = label
+        self.count = count
+        self.itemSize = itemSize
+        self.itemLabel = itemLabel
+
+    def decode(self, msg):
+        count = getattr(msg, self.count)
+        if count is None:  # truncated message
+            return None
+        count = count.value
+        if self.itemLabel is None:
+            return OctetData.from_buffer(msg.raw, self.offset, count*self.itemSize, self.label, False, byte_order="little")
+        return [OctetData.from_buffer(msg.raw, self.offset + i*self.itemSize, self.itemSize, self.itemLabel.format(i), False, byte_order="little")
+                for i in range(count)]
+
+def compile_schema(msgType):
+    schema = msgType.SCHEMA
+    msgType.FIELDS = tuple(field.name for field in schema)
+    for field in schema:
+        setattr(msgType, field.name, field)
+    # LAYOUT: the fields with a struct format, in offset order, skipping the octets in between (message ID first)
+    codes = []
+    layout_fields = []
+    position = 0
+    for field in sorted(schema, key=lambda field: field.offset):
+        if field.code is None or field.offset < position:  # overlaps the field before
+            continue
+        if field.offset > position:
+            codes.append("{}x".format(field.offset - position))
+        codes.append(field.code)
+        layout_fields.append(field)
+        position = field.offset + field.size
+    msgType.LAYOUT = struct.Struct("<" + "".join(codes))
+    msgType.LAYOUT_FIELDS = tuple(layout_fields)
+    # each field with the index of its value in the LAYOUT, None if decoded on its own
+    msgType.RECORD_PLAN = tuple((field, layout_fields.index(field) if field in layout_fields else None) for field in schema)
+    # variable-length part: the message is HEADER_LENGTH octets, then count items
+    variable = [field for field in schema if isinstance(field, ArrayField)]
+    msgType.VARIABLE_LENGTH = bool(variable)
+    if variable:
+        msgType.HEADER_LENGTH = variable[0].offset
+        msgType.ITEM_SIZE = variable[0].itemSize
+        msgType.COUNT_FIELD = getattr(msgType, variable[0].count)
+    else:
+        msgType.COUNT_FIELD = None
+    msgType.ID_LINE = "Message ID: {0} ({1})\n".format(msgType.MSG_ID, msgType.MSG_ID_NAME)
+    # BREAKDOWN: data_breakdown of a message holding the whole LAYOUT, the variable-length part is added line by line
+    # named arguments: s (start spacing), i (indent), h (message hex), n (message length), then each field's line_args
+    fixed = [field for field in schema if field not in variable]
+    msgType.BREAKDOWN = "{s}" + escape(msgType.NAME) + ": 0x{h} - Length: {n}\n{i}" + escape(msgType.ID_LINE) + \
+        "".join("{i}" + field.line() + "\n" for field in fixed)
+    msgType.BREAKDOWN_PLAN = tuple((field, layout_fields.index(field) if field in layout_fields else None) for field in fixed)
+    msgType.BREAKDOWN_ARRAYS = tuple(variable)
+
+class Message:
+    # common superclass for DWM1001 messages, each subclass describes its fields in SCHEMA
+    SCHEMA = ()
+    FIELDS = ()  # names of the decoded fields, in message order
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        compile_schema(cls)
 
-class MsgJoinRequest:
-    VARIABLE_LENGTH = False
-    LENGTH = 18
-    MSG_ID = "12"
-    MSG_ID_NAME = "UWBMAC_FRM_TYPE_CL_JOIN"
     def __init__(self, data):
-        # decode payload
-        self.hardwareVersion = OctetData(slice_octets(data, 1, 4, endianness="little"), "Hardware Version", False)
-        self.firmwareVersion = OctetData(slice_octets(data, 5, 4, endianness="little"), "Firmware Version", False)
-        self.firmwareChecksum = OctetData(slice_octets(data, 9, 4, endianness="little"), "Firmware Checksum (CRC32)", False)
-        self.options = OctetData(slice_octets(data, 13, 4, endianness="little"), "Options", True)
-        self.clusterSeat = OctetData(slice_octets(data, 17, 1, endianness="little"), "Cluster Seat", True)
-        # store message data
-        self.data = OctetData(slice_octets(data, 0, self.LENGTH, endianness="big"), "Join Request Message", False)
-        self.length = self.LENGTH  # no. octets
+        # keep the raw message, its fields are decoded on first access
+        self.raw = data
+        length = self.message_length(data)
+        self.length = len(data) if length is None else length  # no. octets
+
+    @classmethod
+    def message_length(cls, data, start=0):
+        # no. octets of the message at data[start], read without decoding it
+        # None if the data ends before its count field (variable-length part), at most the octets left
+        count = cls.COUNT_FIELD
+        if count is None:
+            return min(cls.LENGTH, len(data) - start)
+        offset = start + count.offset
+        if offset + count.size > len(data):
+            return None
+        length = cls.HEADER_LENGTH + cls.ITEM_SIZE * count.layout.unpack_from(data, offset)[0]
+        return min(length, len(data) - start)  # a corrupt count must not reach past the data
+
+    @LazyField
+    def data(self):
+        return OctetData.from_buffer(self.raw, 0, self.length, self.NAME, False)
+
+    def decode_fields(self):
+        # decode every field: the LAYOUT ones in one unpack, then the others
+        fields = self.__dict__
+        raw = self.raw
+        if len(raw) >= self.LAYOUT.size:
+            for field, value in zip(self.LAYOUT_FIELDS, self.LAYOUT.unpack_from(raw)):
+                if field.name not in fields:
+                    fields[field.name] = field.build(self, value)
+        for name in self.FIELDS:
+            getattr(self, name)
 
     def to_string(self):
-        return self.data.to_string()  # Join request message data
+        return self.data.to_string()  # message data
+
+    @LazyField
+    def record(self):
+        # compact, picklable form of the message: (message ID, field values...), decoded once
+        # (the writers and the metrics' decode stage share it)
+        raw = self.raw
+        if len(raw) < self.LAYOUT.size:  # truncated message
+            return (self.MSG_ID,) + tuple(record_value(getattr(self, name)) for name in self.FIELDS)
+        values = self.LAYOUT.unpack_from(raw)
+        return (self.MSG_ID,) + tuple(record_value(getattr(self, field.name)) if i is None else field.plain(self, values[i])
+                                      for field, i in self.RECORD_PLAN)
+
+    def to_record(self):
+        return self.record
+
+    def to_dict(self):
+        msg_dict = {"msgId": self.MSG_ID, "msgName": self.MSG_ID_NAME}
+        msg_dict.update(zip(self.FIELDS, self.to_record()[1:]))
+        return msg_dict
 
     def data_breakdown(self, num_spaces):
-        start_spacing = ""
-        for i in range(num_spaces):
-            start_spacing += "  "
+        start_spacing = "  " * num_spaces
         indented = start_spacing + "  "
-        data_str = ""
+        raw = self.raw
+        if len(raw) < self.LAYOUT.size:  # truncated message
+            return self.truncated_breakdown(start_spacing, indented)
+        values = self.LAYOUT.unpack_from(raw)
+        args = []
+        for field, i in self.BREAKDOWN_PLAN:
+            args += field.line_args(self, None if i is None else values[i])
+        data_str = self.BREAKDOWN.format(*args, s=start_spacing, i=indented, h=raw[:self.length].hex(), n=self.length)
+        for field in self.BREAKDOWN_ARRAYS:
+            value = getattr(self, field.name)
+            if isinstance(value, list):
+                for item in value:
+                    data_str += indented + item.to_string() + "\n"
+            elif value is not None:
+                data_str += indented + value.to_string() + "\n"
+        return data_str
+
+    def truncated_breakdown(self, start_spacing, indented):
+        # field by field, fields past the end are left out
         # Message metadata
-        data_str += start_spacing + self.data.to_string() + " - "   # Join request message
-        data_str += "Length: " + str(self.length) + "\n"    # Join request message length
-        data_str += indented + "Message ID: {0} ({1})".format(self.MSG_ID, self.MSG_ID_NAME) + "\n"  # Message ID
-        # Message contents
-        data_str += indented + self.hardwareVersion.to_string() + "\n"  # Hardware Version
-        data_str += indented + self.firmwareVersion.to_string() + "\n"  # Firmware Version
-        data_str += indented + self.firmwareChecksum.to_string() + "\n" # Firmware Checksum
-        data_str += indented + self.options.to_string() + "\n"  # Options (bitmap)
-        data_str += indented + self.clusterSeat.to_string() + "\n"  # Cluster Seat
+        data_str = start_spacing + self.data.to_string() + " - "  # message data
+        data_str += "Length: " + str(self.length) + "\n"  # message length
+        data_str += indented + self.ID_LINE  # Message ID
+        # Message contents, one line per field (per item for lists)
+        self.decode_fields()
+        for name in self.FIELDS:
+            value = getattr(self, name)
+            if value is None:
+                continue
+            if isinstance(value, list):
+                for item in value:
+                    data_str += indented + item.to_string() + "\n"
+            else:
+                data_str += indented + value.to_string() + "\n"
         # return data
         return data_str
 
-class MsgJoinConfirmation:
-    VARIABLE_LENGTH = False
+@register_message
+class MsgBeacon(Message):
+    LENGTH = 23
+    MSG_ID = "10"
+    MSG_ID_NAME = "UWBMAC_FRM_TYPE_BCN"
+    NAME = "Beacon Message"
+    SCHEMA = (
+        OctetField("sessionId", 1, 1, "Session ID"),
+        OctetField("clusterFlags", 2, 2, "Cluster Flags", True, endianness="big"),
+        OctetField("sfNumber", 4, 2, "Superframe Number"),
+        OctetField("clusterSlotNumber", 6, 1, "Cluster Slot Number"),
+        OctetField("clusterMap", 7, 4, "Cluster Map", True, endianness="big"),
+        OctetField("dataSlotMap", 11, 2, "Data Slot Map", True),
+        OctetField("nonce", 13, 10, "NONCE"),
+    )
+
+@register_message
+class MsgJoinRequest(Message):
+    LENGTH = 18
+    MSG_ID = "12"
+    MSG_ID_NAME = "UWBMAC_FRM_TYPE_CL_JOIN"
+    NAME = "Join Request Message"
+    SCHEMA = (
+        OctetField("hardwareVersion", 1, 4, "Hardware Version"),
+        OctetField("firmwareVersion", 5, 4, "Firmware Version"),
+        OctetField("firmwareChecksum", 9, 4, "Firmware Checksum (CRC32)"),
+        OctetField("options", 13, 4, "Options", True),
+        OctetField("clusterSeat", 17, 1, "Cluster Seat", True),
+    )
+
+@register_message
+class MsgJoinConfirmation(Message):
     LENGTH = 5
     MSG_ID = "13"
     MSG_ID_NAME = "UWBMAC_FRM_TYPE_CL_JOIN_CFM"
-    def __init__(self, data):
-        # decode payload
-        self.address = OctetData(slice_octets(data, 1, 2, endianness="little"), "Address", False)   # locked address of the joining node
-        self.clusterLock = OctetData(slice_octets(data, 3, 1, endianness="little"), "Cluster Lock", False)  # Lock counter (decrementing)
-        self.clusterSeat = OctetData(slice_octets(data, 4, 1, endianness="little"), "Cluster Seat", False)  # Allocated seat number
-        # store message data
-        self.data = OctetData(slice_octets(data, 0, self.LENGTH, endianness="big"), "Join Confirmation Message", False)
-        self.length = self.LENGTH  # no. octets
-
-    def to_string(self):
-        return self.data.to_string()  # Join confirmation message data
-
-    def data_breakdown(self, num_spaces):
-        start_spacing = ""
-        for i in range(num_spaces):
-            start_spacing += "  "
-        indented = start_spacing + "  "
-        data_str = ""
-        # Message metadata
-        data_str += start_spacing + self.data.to_string() + " - "   # Join confirmation message
-        data_str += "Length: " + str(self.length) + "\n"    # Join confirmation message length
-        data_str += indented + "Message ID: {0} ({1})".format(self.MSG_ID, self.MSG_ID_NAME) + "\n"  # Message ID
-        # Message contents
-        data_str += indented + self.address.to_string() + "\n"  # Address
-        data_str += indented + self.clusterLock.to_string() + "\n"  # Cluster Lock
-        data_str += indented + self.clusterSeat.to_string() + "\n"  # Cluster Seat
-        # return data
-        return data_str
+    NAME = "Join Confirmation Message"
+    SCHEMA = (
+        OctetField("address", 1, 2, "Address"),  # locked address of the joining node
+        OctetField("clusterLock", 3, 1, "Cluster Lock"),  # Lock counter (decrementing)
+        OctetField("clusterSeat", 4, 1, "Cluster Seat"),  # Allocated seat number
+    )
 
 # TODO: Almanac frame data does not match DWM1001 System Overview
-class MsgAlmanac:
-    VARIABLE_LENGTH = False
+@register_message
+class MsgAlmanac(Message):
     LENGTH = 47 #48
     MSG_ID = "23"
     MSG_ID_NAME = "UWBMAC_FRM_TYPE_ALMA"
-    def __init__(self, data):
-        # decode payload
-        self.nonce = OctetData(slice_octets(data, 1, 10, endianness="little"), "NONCE", False)   # network NONCE
-        #self.flags = OctetData(slice_octets(data, 11, 1, endianness="little"), "Flags", False)  # Special flags
-        self.hardwareVersion = OctetData(slice_octets(data, 11, 4, endianness="little"), "Hardware version", False)  # Hardware version of sending node
-        self.firmwareVersion = OctetData(slice_octets(data, 15, 4, endianness="little"), "Firmware version", False)  # Firmware version of sending node
-        self.firmware1Size = OctetData(slice_octets(data, 19, 4, endianness="little"), "Firmware 1 Size", False)  # Firmware 1 size of sending node
-        self.firmware2Size = OctetData(slice_octets(data, 23, 4, endianness="little"), "Firmware 2 Size", False)  # Firmware 2 size of sending node
-        self.firmware1Checksum = OctetData(slice_octets(data, 27, 4, endianness="little"), "Firmware 1 Checksum", False)  # Firmware 1 checksum of sending node
-        self.firmware2Checksum = OctetData(slice_octets(data, 31, 4, endianness="little"), "Firmware 2 Checksum", False)  # Firmware 2 checksum of sending node
-        self.nodeId = OctetData(slice_octets(data, 35, 8, endianness="little"), "Node ID", False)  # Complete 64-bit address of sending node
-        self.nodeOption = OctetData(slice_octets(data, 43, 4, endianness="little"), "Node Option", True)    # Bitmap indicating node capabilities
-        # store message data
-        self.data = OctetData(data, "Almanac Message", False)
-        self.length = self.LENGTH  # no. octets
-
-    def data_breakdown(self, num_spaces):
-        start_spacing = ""
-        for i in range(num_spaces):
-            start_spacing += "  "
-        indented = start_spacing + "  "
-        data_str = ""
-        # Message metadata
-        data_str += start_spacing + self.data.to_string() + " - "   # Almanac message
-        data_str += "Length: " + str(self.length) + "\n"    # Almanac message length
-        data_str += indented + "Message ID: {0} ({1})".format(self.MSG_ID, self.MSG_ID_NAME) + "\n"  # Message ID
-        # Message contents
-        data_str += indented + self.nonce.to_string() + "\n"
-        #data_str += indented + self.flags.to_string() + "\n"
-        data_str += indented + self.hardwareVersion.to_string() + "\n"
-        data_str += indented + self.firmwareVersion.to_string() + "\n"
-        data_str += indented + self.firmware1Size.to_string() + "\n"
-        data_str += indented + self.firmware2Size.to_string() + "\n"
-        data_str += indented + self.firmware1Checksum.to_string() + "\n"
-        data_str += indented + self.firmware2Checksum.to_string() + "\n"
-        data_str += indented + self.nodeId.to_string() + "\n"
-        data_str += indented + self.nodeOption.to_string() + "\n"
-        # return data
-        return data_str
-
-class MsgService:
-    VARIABLE_LENGTH = True
+    NAME = "Almanac Message"
+    SCHEMA = (
+        OctetField("nonce", 1, 10, "NONCE"),  # network NONCE
+        #OctetField("flags", 11, 1, "Flags"),  # Special flags
+        OctetField("hardwareVersion", 11, 4, "Hardware version"),  # Hardware version of sending node
+        OctetField("firmwareVersion", 15, 4, "Firmware version"),  # Firmware version of sending node
+        OctetField("firmware1Size", 19, 4, "Firmware 1 Size"),  # Firmware 1 size of sending node
+        OctetField("firmware2Size", 23, 4, "Firmware 2 Size"),  # Firmware 2 size of sending node
+        OctetField("firmware1Checksum", 27, 4, "Firmware 1 Checksum"),  # Firmware 1 checksum of sending node
+        OctetField("firmware2Checksum", 31, 4, "Firmware 2 Checksum"),  # Firmware 2 checksum of sending node
+        OctetField("nodeId", 35, 8, "Node ID"),  # Complete 64-bit address of sending node
+        OctetField("nodeOption", 43, 4, "Node Option", True),  # Bitmap indicating node capabilities
+    )
+
+class MsgService(Message):
     MAX_LENGTH = 17
-    HEADER_LENGTH = 3
     MSG_ID = "23"
     MSG_ID_NAME = "UWBMAC_FRM_TYPE_SVC"
-    def __init__(self, data):
-        # decode payload
-        self.code = OctetData(slice_octets(data, 1, 1, endianness="little"), "Code", False)
-        self.argc = NumData(slice_octets(data, 2, 1, endianness="little"), "No. argument octets", unpack_format='b')
-        self.argv = OctetData(slice_octets(data, 3, self.argc.value, endianness="little"), "Arguments", False)
-        # store message data
-        self.length = self.argc.value + self.HEADER_LENGTH
-        self.data = OctetData(slice_octets(data, 0, self.length, endianness="big"), "Service Message", False)
-
-    def to_string(self):
-        return self.data.to_string()  # Response message data
-
-    def data_breakdown(self, num_spaces):
-        start_spacing = ""
-        for i in range(num_spaces):
-            start_spacing += "  "
-        indented = start_spacing + "  "
-        data_str = ""
-        # Message metadata
-        data_str += start_spacing + self.data.to_string() + " - "   # Service message
-        data_str += "Length: " + str(self.length) + "\n"    # Service message length
-        data_str += indented + "Message ID: {0} ({1})".format(self.MSG_ID, self.MSG_ID_NAME) + "\n"  # Message ID
-        # Message contents
-        data_str += indented + self.code.to_string() + "\n"
-        data_str += indented + self.argc.to_string() + "\n"
-        data_str += indented + self.argv.to_string() + "\n"
-        # return data
-        return data_str
-
-class MsgFwUpdateRequest:
-    VARIABLE_LENGTH = False
+    NAME = "Service Message"
+    SCHEMA = (
+        OctetField("code", 1, 1, "Code"),
+        NumField("argc", 2, UINT8, "No. argument octets"),
+        ArrayField("argv", 3, "Arguments", count="argc"),
+    )
+
+class MsgFwUpdateRequest(Message):
     LENGTH = 24
     MSG_ID = "21"
     MSG_ID_NAME = "UWBMAC_FRM_TYPE_FWUP_DATA_REQ"
-    def __init__(self, data):
-        # decode payload
-        self.flags = OctetData(slice_octets(data, 1, 1, endianness="little"), "Flags", False)
-        # TODO: verify update period decoding
-        self.updatePeriod = NumData(slice_octets(data, 2, 2), "Update period (ms)", '<h', endianness="little")
-        self.addr16_0 = OctetData(slice_octets(data, 4, 2, endianness="little"), "Addr16 0", False)
-        self.addr16_1 = OctetData(slice_octets(data, 6, 2, endianness="little"), "Addr16 1", False)
-        self.addr16_2 = OctetData(slice_octets(data, 8, 2, endianness="little"), "Addr16 2", False)
-        self.addr16_3 = OctetData(slice_octets(data, 10, 2, endianness="little"), "Addr16 3", False)
-        self.offset = OctetData(slice_octets(data, 12, 4, endianness="little"), "Offset", False)
-        self.firmwareSize = OctetData(slice_octets(data, 16, 4, endianness="little"), "Firmware Size", False)
-        self.firmwareChecksum = OctetData(slice_octets(data, 20, 4, endianness="little"), "Firmware Checksum", False)
-        # store message data
-        self.data = OctetData(slice_octets(data, 0, self.LENGTH, endianness="big"), "Firmware Update Data Request Message", False)
-        self.length = self.LENGTH  # no. octets
-
-    def data_breakdown(self, num_spaces):
-        start_spacing = ""
-        for i in range(num_spaces):
-            start_spacing += "  "
-        indented = start_spacing + "  "
-        data_str = ""
-        # Message metadata
-        data_str += start_spacing + self.data.to_string() + " - "   # Beacon message
-        data_str += "Length: " + str(self.length) + "\n"    # Beacon message length
-        data_str += indented + "Message ID: {0} ({1})".format(self.MSG_ID, self.MSG_ID_NAME) + "\n"  # Message ID
-        # Message contents
-        data_str += indented + self.flags.to_string() + "\n"
-        data_str += indented + self.updatePeriod.to_string() + "\n"
-        data_str += indented + self.addr16_0.to_string() + "\n"
-        data_str += indented + self.addr16_1.to_string() + "\n"
-        data_str += indented + self.addr16_2.to_string() + "\n"
-        data_str += indented + self.addr16_3.to_string() + "\n"
-        data_str += indented + self.offset.to_string() + "\n"
-        data_str += indented + self.firmwareSize.to_string() + "\n"
-        data_str += indented + self.firmwareChecksum.to_string() + "\n"
-        # return data
-        return data_str
-
-class MsgFwUpdateData:
-    VARIABLE_LENGTH = True
+    NAME = "Firmware Update Data Request Message"
+    SCHEMA = (
+        OctetField("flags", 1, 1, "Flags"),
+        NumField("updatePeriod", 2, INT16_LE, "Update period (ms)"),  # TODO: verify update period decoding
+        OctetField("addr16_0", 4, 2, "Addr16 0"),
+        OctetField("addr16_1", 6, 2, "Addr16 1"),
+        OctetField("addr16_2", 8, 2, "Addr16 2"),
+        OctetField("addr16_3", 10, 2, "Addr16 3"),
+        OctetField("offset", 12, 4, "Offset"),
+        OctetField("firmwareSize", 16, 4, "Firmware Size"),
+        OctetField("firmwareChecksum", 20, 4, "Firmware Checksum"),
+    )
+
+class MsgFwUpdateData(Message):
     MAX_LENGTH = 52
-    HEADER_LENGTH = 8
     MSG_ID = "22"
     MSG_ID_NAME = "UWBMAC_FRM_TYPE_FWUP_DATA"
-    def __init__(self, data):
-        # decode payload
-        self.flags = OctetData(slice_octets(data, 1, 1, endianness="little"), "Flags", False)
-        self.slotDataMap = OctetData(slice_octets(data, 2, 2, endianness="little"), "Slot Data Map", False)
-        self.offset = OctetData(slice_octets(data, 4, 3, endianness="little"), "Offset", False)
-        self.dataLength = NumData(slice_octets(data, 7, 1, endianness="little"), "Length", unpack_format='b')
-        self.buffer = OctetData(slice_octets(data, 8, self.dataLength.value, endianness="little"), "Buffer", False)
-        # store message data
-        self.length = self.dataLength.value + self.HEADER_LENGTH
-        self.data = OctetData(slice_octets(data, 0, self.length, endianness="big"), "Firmware Update Data Message", False)
-
-    def data_breakdown(self, num_spaces):
-        start_spacing = ""
-        for i in range(num_spaces):
-            start_spacing += "  "
-        indented = start_spacing + "  "
-        data_str = ""
-        # Message metadata
-        data_str += start_spacing + self.data.to_string() + " - "   # Beacon message
-        data_str += "Length: " + str(self.length) + "\n"    # Beacon message length
-        data_str += indented + "Message ID: {0} ({1})".format(self.MSG_ID, self.MSG_ID_NAME) + "\n"  # Message ID
-        # Message contents
-        data_str += indented + self.flags.to_string() + "\n"
-        data_str += indented + self.slotDataMap.to_string() + "\n"
-        data_str += indented + self.offset.to_string() + "\n"
-        data_str += indented + self.dataLength.to_string() + "\n"
-        data_str += indented + self.buffer.to_string() + "\n"
-        # return data
-        return data_str
-
-class MsgPosition:
-    VARIABLE_LENGTH = False
+    NAME = "Firmware Update Data Message"
+    SCHEMA = (
+        OctetField("flags", 1, 1, "Flags"),
+        OctetField("slotDataMap", 2, 2, "Slot Data Map"),
+        OctetField("offset", 4, 3, "Offset"),
+        NumField("dataLength", 7, UINT8, "Length"),
+        ArrayField("buffer", 8, "Buffer", count="dataLength"),
+    )
+
+@register_message
+class MsgPosition(Message):
     LENGTH = 17
     MSG_ID = "18"
     MSG_ID_NAME = "UWBMAC_FRM_TYPE_POS"
-    def __init__(self, data):
-        # decode payload
-        self.x = NumData(slice_octets(data, 1, 4), "X coordinate (m)", '<f', endianness="little")
-        self.y = NumData(slice_octets(data, 5, 4), "Y coordinate (m)", '<f', endianness="little")
-        self.z = NumData(slice_octets(data, 9, 4), "Z coordinate (m)", '<f', endianness="little")
-        self.padding = OctetData(slice_octets(data, 13, 4, endianness="little"), "Padding", False)
-        # store message data
-        self.data = OctetData(slice_octets(data, 0, self.LENGTH, endianness="big"), "Position Message", False)
-        self.length = self.LENGTH  # no. octets
-
-    def to_string(self):
-        return self.data.to_string()  # Position message data
-
-    def data_breakdown(self, num_spaces):
-        start_spacing = ""
-        for i in range(num_spaces):
-            start_spacing += "  "
-        indented = start_spacing + "  "
-        data_str = ""
-        # Message metadata
-        data_str += start_spacing + self.data.to_string() + " - "   # Beacon message
-        data_str += "Length: " + str(self.length) + "\n"    # Beacon message length
-        data_str += indented + "Message ID: {0} ({1})".format(self.MSG_ID, self.MSG_ID_NAME) + "\n"  # Message ID
-        # Message contents
-        data_str += indented + self.x.to_string() + "\n"  # X Coordinate
-        data_str += indented + self.y.to_string() + "\n"  # Y Coordinate
-        data_str += indented + self.z.to_string() + "\n"  # Z Coordinate
-        data_str += indented + self.padding.to_string() + "\n"  # Padding
-        # return data
-        return data_str
-
-
-class MsgGroupPoll:
-    VARIABLE_LENGTH = False
+    NAME = "Position Message"
+    SCHEMA = (
+        NumField("x", 1, FLOAT_LE, "X coordinate (m)"),
+        NumField("y", 5, FLOAT_LE, "Y coordinate (m)"),
+        NumField("z", 9, FLOAT_LE, "Z coordinate (m)"),
+        OctetField("padding", 13, 4, "Padding"),
+    )
+
+@register_message
+class MsgGroupPoll(Message):
     LENGTH = 29
     MSG_ID = "30"
     MSG_ID_NAME = "UWBMAC_FRM_TYPE_TWR_GRP_POLL"
-    def __init__(self, data):
-        # decode payload
-        self.flags = OctetData(slice_octets(data, 1, 2, endianness="little"), "Flags", True)
-        self.updatePeriod = NumData(slice_octets(data, 3, 2), "Update Period", '<h', endianness="little")
-        self.address0 = OctetData(slice_octets(data, 5, 2, endianness="little"), "Address (Anchor 0)", False)
-        self.address1 = OctetData(slice_octets(data, 7, 2, endianness="little"), "Address (Anchor 1)", False)
-        self.address2 = OctetData(slice_octets(data, 9, 2, endianness="little"), "Address (Anchor 2)", False)
-        self.address3 = OctetData(slice_octets(data, 11, 2, endianness="little"), "Address (Anchor 3)", False)
-        self.sequenceNumber = OctetData(slice_octets(data, 13, 1, endianness="little"), "TWR Sequence Number", False)
+    NAME = "Group Poll Message"
+    SCHEMA = (
+        OctetField("flags", 1, 2, "Flags", True),
+        NumField("updatePeriod", 3, INT16_LE, "Update Period"),
+        OctetField("address0", 5, 2, "Address (Anchor 0)"),
+        OctetField("address1", 7, 2, "Address (Anchor 1)"),
+        OctetField("address2", 9, 2, "Address (Anchor 2)"),
+        OctetField("address3", 11, 2, "Address (Anchor 3)"),
+        OctetField("sequenceNumber", 13, 1, "TWR Sequence Number"),
         # TODO: verify bit sequence for startionary flag and quality factor
-        octet_statflag_qfactor = slice_octets(data, 14, 1, endianness="little")
-        statflag_qfactor = octets_to_binary(octet_statflag_qfactor, 1, "big")
-        self.stationaryFlag = BitFlag(statflag_qfactor[7], "Stationary Flag")
-        # TODO: cast bits back into octet
-        #qfactor = '0' + statflag_qfactor[0:7]
-        #self.qualityFactor = NumData(qfactor, "Quality Factor", unpack_format='b', endianness="little")
-
-        # temporary Quality Factor computation
-        self.qualityFactor = NumData(octet_statflag_qfactor, "Quality Factor", unpack_format='b', endianness="little")
-
-        self.x = NumData(slice_octets(data, 15, 4), "Last Calculated X (m)", unpack_format='<f', endianness="little")
-        self.y = NumData(slice_octets(data, 19, 4), "Last Calculated Y (m)", unpack_format='<f', endianness="little")
-        self.z = NumData(slice_octets(data, 23, 4), "Last Calculated Z (m)", unpack_format='<f', endianness="little")
-        self.padding = OctetData(slice_octets(data, 27, 2, endianness="little"), "Padding", False)
-
-        # store message data
-        self.data = OctetData(data, "Group Poll Message", False)
-        self.length = self.LENGTH  # no. octets
-
-    def to_string(self):
-        return self.data.to_string()  # Group Poll message data
-
-    def data_breakdown(self, num_spaces):
-        start_spacing = ""
-        for i in range(num_spaces):
-            start_spacing += "  "
-        indented = start_spacing + "  "
-        data_str = ""
-        # Message metadata
-        data_str += start_spacing + self.data.to_string() + " - "   # Group Poll message
-        data_str += "Length: " + str(self.length) + "\n"    # Group Poll message length
-        data_str += indented + "Message ID: {0} ({1})".format(self.MSG_ID, self.MSG_ID_NAME) + "\n"  # Message ID
-        # Message contents
-        data_str += indented + self.flags.to_string() + "\n"  # Flags
-        data_str += indented + self.updatePeriod.to_string() + "\n"  # Update Period
-        data_str += indented + self.address0.to_string() + "\n"  # Address of anchor 0
-        data_str += indented + self.address1.to_string() + "\n"  # Address of anchor 1
-        data_str += indented + self.address2.to_string() + "\n"  # Address of anchor 2
-        data_str += indented + self.address3.to_string() + "\n"  # Address of anchor 3
-        data_str += indented + self.sequenceNumber.to_string() + "\n"  # TWR Sequence Number
-        data_str += indented + self.stationaryFlag.to_string() + "\n"  # Stationary Flag
-        data_str += indented + self.qualityFactor.to_string() + "\n"  # Quality Factor
-        data_str += indented + self.x.to_string() + "\n"  # Last Calculated X Coordinate
-        data_str += indented + self.y.to_string() + "\n"  # Last Calculated Y Coordinate
-        data_str += indented + self.z.to_string() + "\n"  # Last Calculated Z Coordinate
-        data_str += indented + self.padding.to_string() + "\n"  # Padding
-        # return data
-        return data_str
-
-class MsgResponse:
-    VARIABLE_LENGTH = False
+        FlagField("stationaryFlag", 14, 0, "Stationary Flag"),
+        # TODO: cast bits back into octet, temporary Quality Factor computation (whole octet)
+        NumField("qualityFactor", 14, INT8, "Quality Factor"),
+        NumField("x", 15, FLOAT_LE, "Last Calculated X (m)"),
+        NumField("y", 19, FLOAT_LE, "Last Calculated Y (m)"),
+        NumField("z", 23, FLOAT_LE, "Last Calculated Z (m)"),
+        OctetField("padding", 27, 2, "Padding"),
+    )
+
+@register_message
+class MsgResponse(Message):
     LENGTH = 22
     MSG_ID = "31"
     MSG_ID_NAME = "UWBMAC_FRM_TYPE_TWR_POLL"
-    def __init__(self, data):
-        # decode payload
-        # TODO: bits in flags most likely could be flipped
-        self.flags = OctetData(slice_octets(data, 1, 1, endianness="little"), "Flags", True, endianness="little")
-        self.slotMap = OctetData(slice_octets(data, 2, 2, endianness="little"), "Slot Map", True)
-        # TODO: Decode timestamp
-        self.gpTimestamp = OctetData(slice_octets(data, 4, 4, endianness="little"), "Group Poll (GP) Timestamp", False)
-        self.rTimestamp = OctetData(slice_octets(data, 8, 4, endianness="little"), "R (Response) TX Timestamp", False)  # This message (Response) TX timestamp
-        self.nonce = OctetData(slice_octets(data, 12, 10, endianness="little"), "NONCE", False)
-        # store message data
-        self.data = OctetData(data, "Response Message", False)
-        self.length = self.LENGTH  # no. octets
-
-    def to_string(self):
-        return self.data.to_string()  # Response message data
-
-    def data_breakdown(self, num_spaces):
-        start_spacing = ""
-        for i in range(num_spaces):
-            start_spacing += "  "
-        indented = start_spacing + "  "
-        data_str = ""
-        # Message metadata
-        data_str += start_spacing + self.data.to_string() + " - "   # Response message
-        data_str += "Length: " + str(self.length) + "\n"    # Response message length
-        data_str += indented + "Message ID: {0} ({1})".format(self.MSG_ID, self.MSG_ID_NAME) + "\n"  # Message ID
-        # Message contents
-        data_str += indented + self.flags.to_string() + "\n"  # Flags
-        data_str += indented + self.slotMap.to_string() + "\n"  # Slot Map
-        data_str += indented + self.gpTimestamp.to_string() + "\n"  # GP Timestamp
-        data_str += indented + self.rTimestamp.to_string() + "\n"  # R Timestamp
-        data_str += indented + self.nonce.to_string() + "\n"  # NONCE
-        # return data
-        return data_str
-
-class MsgBridgeNodeBeacon:
-    VARIABLE_LENGTH = True
+    NAME = "Response Message"
+    SCHEMA = (
+        OctetField("flags", 1, 1, "Flags", True),  # TODO: bits in flags most likely could be flipped
+        OctetField("slotMap", 2, 2, "Slot Map", True),
+        # lower 32 bits of the DW1000 timestamps of the anchor
+        OctetField("gpTimestamp", 4, 4, "Group Poll (GP) Timestamp", octetType=Timestamp),  # Group Poll RX timestamp
+        OctetField("rTimestamp", 8, 4, "R (Response) TX Timestamp", octetType=Timestamp),  # This message (Response) TX timestamp
+        OctetField("nonce", 12, 10, "NONCE"),
+    )
+
+class MsgBridgeNodeBeacon(Message):
     MAX_LENGTH = 40
-    HEADER_LENGTH = 10
     MSG_ID = "6a"
     MSG_ID_NAME = "UWBMAC_FRM_TYPE_BN_BCN"
-    def __init__(self, data):
-        # decode payload
-        self.clusterMap = OctetData(slice_octets(data, 1, 4, endianness="little"), "Cluster Map", True, endianness="big")   # occupied BN cluster seats visible by the sending anchor
-        self.address = OctetData(slice_octets(data, 5, 2, endianness="little"), "Address", False)   # address of joining bridge node
-        self.bnClusterLock = OctetData(slice_octets(data, 7, 1, endianness="little"), "BN Cluster Lock", False)  # Lock counter (decrementing)
-        self.bnClusterSeat = OctetData(slice_octets(data, 8, 1, endianness="little"), "BN Cluster Seat", False)  # Confirming allocated BN cluster seat number
-        self.count = NumData(slice_octets(data, 9, 1, endianness="little"), "No. tag addresses", unpack_format='b') # Number of tag addresses
-        # TODO: Verify tag addresses
-        self.tagAddresses = []
-        for i in range(self.count):
-            startOctet = 10 + (i*2)
-            self.tagAddresses.append(Data(slice_octets(data, startOctet, 2, endianness="little"), "Tag Address {}".format(i), False))    # Tag address
-        # store message data
-        self.length = self.HEADER_LENGTH + 2*self.count.value
-        self.data = OctetData(slice_octets(data, 0, self.length, endianness="big"), "Bridge Node Beacon Message", False)
-
-    def to_string(self):
-        return self.data.to_string()  # Response message data
-
-    def data_breakdown(self, num_spaces):
-        start_spacing = ""
-        for i in range(num_spaces):
-            start_spacing += "  "
-        indented = start_spacing + "  "
-        data_str = ""
-        # Message metadata
-        data_str += start_spacing + self.data.to_string() + " - "   # Bridge Node Beacon message
-        data_str += "Length: " + str(self.length) + "\n"    # Bridge Node Beacon message length
-        data_str += indented + "Message ID: {0} ({1})".format(self.MSG_ID, self.MSG_ID_NAME) + "\n"  # Message ID
-        # Message contents
-        data_str += indented + self.clusterMap.to_string() + "\n"
-        data_str += indented + self.address.to_string() + "\n"
-        data_str += indented + self.bnClusterLock.to_string() + "\n"
-        data_str += indented + self.bnClusterSeat.to_string() + "\n"
-        data_str += indented + self.count.to_string() + "\n"
-        for i in range(self.count):
-            data_str += indented + self.tagAddresses[i].to_string() + "\n"
-        # return data
-        return data_str
-
-class MsgIotDataDownlink:
-    VARIABLE_LENGTH = True
+    NAME = "Bridge Node Beacon Message"
+    SCHEMA = (
+        OctetField("clusterMap", 1, 4, "Cluster Map", True, endianness="big"),  # occupied BN cluster seats visible by the sending anchor
+        OctetField("address", 5, 2, "Address"),  # address of joining bridge node
+        OctetField("bnClusterLock", 7, 1, "BN Cluster Lock"),  # Lock counter (decrementing)
+        OctetField("bnClusterSeat", 8, 1, "BN Cluster Seat"),  # Confirming allocated BN cluster seat number
+        NumField("count", 9, UINT8, "No. tag addresses"),  # Number of tag addresses
+        ArrayField("tagAddresses", 10, "Tag Addresses", count="count", itemSize=2, itemLabel="Tag Address {}"),  # TODO: Verify tag addresses
+    )
+
+@register_message
+class MsgIotDataDownlink(Message):
     MAX_LENGTH = 41
-    HEADER_LENGTH = 7
     MSG_ID = "63" # for downlink
     MSG_ID_NAME = "UWBMAC_FRM_TYPE_DL_IOT_DATA"
-    def __init__(self, data):
-        # decode payload
-        # TODO: bits in flags most likely could be flipped
-        self.id = OctetData(slice_octets(data, 1, 2, endianness="little"), "ID", False)
-        self.flags = OctetData(slice_octets(data, 3, 1, endianness="little"), "Flags", True)
-        # TODO: Decode update rate
-        self.updateRate = OctetData(slice_octets(data, 4, 2, endianness="little"), "Update Rate", False)
-        self.dataLength = NumData(slice_octets(data, 6, 1, endianness="little"), "Data Length", unpack_format='b')
-        self.iotPayload = OctetData(slice_octets(data, 7, self.dataLength.value, endianness="little"), "IOT Payload", False)
-        # store message data
-        self.length = self.dataLength.value + self.HEADER_LENGTH
-        self.data = OctetData(slice_octets(data, 0, self.length, endianness="big"), "Downlink IOT Data Message", False)
-
-    def to_string(self):
-        return self.data.to_string()  # Response message data
-
-    def data_breakdown(self, num_spaces):
-        start_spacing = ""
-        for i in range(num_spaces):
-            start_spacing += "  "
-        indented = start_spacing + "  "
-        data_str = ""
-        # Message metadata
-        data_str += start_spacing + self.data.to_string() + " - "   # IOT Payload (Downlink) message
-        data_str += "Length: " + str(self.length) + "\n"    # IOT Payload (Downlink) message length
-        data_str += indented + "Message ID: {0} ({1})".format(self.MSG_ID, self.MSG_ID_NAME) + "\n"  # Message ID
-        # Message contents
-        data_str += indented + self.id.to_string() + "\n"
-        data_str += indented + self.flags.to_string() + "\n"
-        data_str += indented + self.updateRate.to_string() + "\n"
-        data_str += indented + self.dataLength.to_string() + "\n"
-        data_str += indented + self.iotPayload.to_string() + "\n"
-        # return data
-        return data_str
-
-class MsgIotDataUplink:
-    VARIABLE_LENGTH = True
+    NAME = "Downlink IOT Data Message"
+    SCHEMA = (
+        OctetField("id", 1, 2, "ID"),
+        OctetField("flags", 3, 1, "Flags", True),  # TODO: bits in flags most likely could be flipped
+        OctetField("updateRate", 4, 2, "Update Rate"),  # TODO: Decode update rate
+        NumField("dataLength", 6, UINT8, "Data Length"),
+        ArrayField("iotPayload", 7, "IOT Payload", count="dataLength"),
+    )
+
+@register_message
+class MsgIotDataUplink(Message):
     MAX_LENGTH = 41
-    HEADER_LENGTH = 7
     MSG_ID = "65" # for uplink
     MSG_ID_NAME = "UWBMAC_FRM_TYPE_UL_IOT_DATA"
-    def __init__(self, data):
-        # decode payload
-        # TODO: bits in flags most likely could be flipped
-        self.id = OctetData(slice_octets(data, 1, 2, endianness="little"), "ID", False)
-        self.flags = OctetData(slice_octets(data, 3, 1, endianness="little"), "Flags", True)
-        # TODO: Decode update rate
-        self.updateRate = OctetData(slice_octets(data, 4, 2, endianness="little"), "Update Rate", False)
-        self.dataLength = NumData(slice_octets(data, 6, 1, endianness="little"), "Data Length", unpack_format='b')
-        self.iotPayload = OctetData(slice_octets(data, 7, self.dataLength.value, endianness="little"), "IOT Payload", False)
-        # store message data
-        self.length = self.dataLength.value + self.HEADER_LENGTH
-        self.data = OctetData(slice_octets(data, 0, self.length, endianness="big"), "Uplink IOT Data Message", False)
+    NAME = "Uplink IOT Data Message"
+    SCHEMA = (
+        OctetField("id", 1, 2, "ID"),
+        OctetField("flags", 3, 1, "Flags", True),  # TODO: bits in flags most likely could be flipped
+        OctetField("updateRate", 4, 2, "Update Rate"),  # TODO: Decode update rate
+        NumField("dataLength", 6, UINT8, "Data Length"),
+        ArrayField("iotPayload", 7, "IOT Payload", count="dataLength"),
+    )
+
+
+def decode_messages(data, decoders=MSG_DECODERS, start=0):
+    # messages of a payload (bytes/memoryview), found by walking its octets until a known message ID comes up
+    # decoders: message ID octet -> class, e.g. with messages that are not registered for the default walk
+    # start: offset of the octet to walk from, a message boundary (see message_ids)
+    messages = []
+    num_octets = len(data)
+    i = start  # octet iterator
+    while i < num_octets:
+        # look up the message ID of the current octet
+        # TODO: only Beacon frames may have certain specific messages appended to it
+        msgType = decoders.get(data[i])
+        if msgType is None:
+            i += 1
+            continue
+        # each message gets a view of its own octets only, over the frame's buffer (no copy)
+        length = msgType.message_length(data, i)
+        if length is None:  # cut off in its header, no message can follow
+            break
+        messages.append(msgType(data[i:i+length]))
+        i += max(length, 1)  # a corrupt length octet must not stall or rewind the walk
+    return messages
+
+def message_ids(data, watched=None, skipped=None):
+    # IDs (octet values) of the messages found by the payload walk of MessagePayload, without decoding them
+    # watched: octet values, e.g. IDs of messages not registered for the default walk: skipped gets (offset, no. messages
+    # before it) for each of these octets the walk skipped, i.e. at a message boundary and not inside a message
+    ids = []
+    i = 0
+    while i < len(data):
+        msgType = MSG_DECODERS.get(data[i])
+        if msgType is None:
+            if watched is not None and data[i] in watched:
+                skipped.append((i, len(ids)))
+            i += 1
+            continue
+        length = msgType.message_length(data, i)
+        if length is None:  # cut off in its header, as for decode_messages
+            break
+        ids.append(data[i])
+        i += max(length, 1)
+    return ids
+
+class PayloadCache:
+    # bounded LRU cache of decoded message lists, keyed by the raw payload octets
+    # DWM1001 nodes repeat many payloads byte for byte (almanacs, join request retries, beacons of a quiet network)
+    def __init__(self, max_size=1024):
+        self.maxSize = max_size  # no. payloads kept
+        self.entries = OrderedDict()  # payload octets -> message list, least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        messages = self.entries.get(key)
+        if messages is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return messages
+
+    def put(self, key, messages):
+        self.entries[key] = messages
+        if len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        return {"size": len(self.entries), "maxSize": self.maxSize, "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
 
     def to_string(self):
-        return self.data.to_string()  # Response message data
-
-    def data_breakdown(self, num_spaces):
-        start_spacing = ""
-        for i in range(num_spaces):
-            start_spacing += "  "
-        indented = start_spacing + "  "
-        data_str = ""
-        # Message metadata
-        data_str += start_spacing + self.data.to_string() + " - "   # IOT Payload (Uplink) message
-        data_str += "Length: " + str(self.length) + "\n"    # IOT Payload (Uplink) message length
-        data_str += indented + "Message ID: {0} ({1})".format(self.MSG_ID, self.MSG_ID_NAME) + "\n"  # Message ID
-        # Message contents
-        data_str += indented + self.id.to_string() + "\n"
-        data_str += indented + self.flags.to_string() + "\n"
-        data_str += indented + self.updateRate.to_string() + "\n"
-        data_str += indented + self.dataLength.to_string() + "\n"
-        data_str += indented + self.iotPayload.to_string() + "\n"
-        # return data
-        return data_str
-
+        lookups = self.hits + self.misses
+        hit_rate = 100 * self.hits / lookups if lookups else 0
+        return "Payload cache: {0} hits ({1:.1f}%), {2} misses, {3} evictions, {4}/{5} payloads".format(
+            self.hits, hit_rate, self.misses, self.evictions, len(self.entries), self.maxSize)
 
 class MessagePayload:
-    MSG_TYPES = [MsgBeacon, MsgJoinRequest, MsgJoinConfirmation, MsgAlmanac, MsgPosition, MsgGroupPoll, MsgResponse, MsgIotDataDownlink, MsgIotDataUplink]
-    def __init__(self, data):
+    MSG_TYPES = list(MSG_DECODERS.values())
+    # optional PayloadCache shared by all payloads, off (None) by default
+    # with a cache, payloads with the same octets share one message list: treat it and its messages as read-only
+    cache = None
+
+    def __init__(self, data):  # bytes/memoryview of the payload
         # store the data
-        self.data = OctetData(data, "Payload", False)
+        self.raw = data
         # decode the data into DWM1001 messages
-        self.messages = []
+        cache = self.cache
+        if cache is not None:
+            key = bytes(data)
+            self.messages = cache.get(key)
+            if self.messages is not None:  # same octets already decoded
+                return
         self.decode_dwm1001_messages()
+        if cache is not None:
+            cache.put(key, self.messages)
+
+    @LazyField
+    def data(self):
+        return OctetData.from_buffer(self.raw, 0, len(self.raw), "Payload", False)
     
     def decode_dwm1001_messages(self):
-        # iterate through each octet until a valid message ID is encountered
-        i = 0  # octet iterator
-        while i < self.data.length:
-            # get current octet
-            octet = self.data.data[i*2 : (i+1)*2]
-            # check if octet matches a message ID
-            # TODO: only Beacon frames may have certain specific messages appended to it
-            for msgType in self.MSG_TYPES:  # TODO: change to dictionary
-                if octet == msgType.MSG_ID:
-                    message = msgType(self.data.data[i*2:])
-                    self.messages.append(message)
-                    i += message.length
-            else:
-                i += 1
+        self.messages = decode_messages(self.raw)
+
+    def to_record(self):
+        return tuple(msg.to_record() for msg in self.messages)
+
+    def to_dict(self):
+        return [msg.to_dict() for msg in self.messages]
 
     def data_breakdown(self, num_spaces):
         start_spacing = ""
         for i in range(num_spaces):
             start_spacing += "  "
-        indented = start_spacing + "  "
         data_str = ""
         # Message metadata
-        data_str += start_spacing + self.data.to_string() + " - "   # Total Payload
-        data_str += "Length: " + str(self.data.length) + "\n"    # Payload length
+        data_str += start_spacing + "Payload: 0x" + self.raw.hex() + " - "   # Total Payload (as self.data.to_string())
+        data_str += "Length: " + str(len(self.raw)) + "\n"    # Payload length
         # Message contents
         for msg in self.messages:
             data_str += msg.data_breakdown(num_spaces+1)
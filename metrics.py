@@ -0,0 +1,218 @@
+import sys
+import threading
+import time
+
+# Counters and stage timers of the decoding pipeline, off unless enabled
+# Every instrumented spot reads the module-level METRICS once and skips the bookkeeping while it is None,
+# so a run without --metrics-port / --stats-interval only pays for that check.
+# Counters and timers are plain dict entries updated by the decoding thread, readers (the HTTP endpoint,
+# the stats line) work on copies, so they never hold the pipeline up.
+
+METRICS = None  # the Metrics of this process once enabled
+
+PREFIX = "uwb_"
+# pipeline stages, in the order a frame goes through them
+STAGES = ("read", "framing", "fcs", "filter", "header", "dispatch", "decode", "track", "format", "output")
+# counter name -> help text
+COUNTERS = {
+    "lines": "Lines read from the sniffers.",
+    "malformed": "Lines that are not a frame in hex.",
+    "bad_fcs": "Frames that failed the FCS check.",
+    "filtered": "Frames skipped by the frame filter.",
+    "frames": "Frames decoded and passed to the output.",
+    "dropped": "Frames dropped because the output queue was full.",
+    "overrun_lines": "Lines dropped because the reader thread's ring buffer was full.",
+    "messages": "Messages decoded, by message ID.",
+    "decode_errors": "Frames that could not be decoded, by error.",
+}
+# gauge name -> help text
+GAUGES = {
+    "queue_depth": "Frames waiting in the queue between the sniffer readers and the writer.",
+    "output_queue_depth": "Formatted frames waiting for the output writer thread.",
+    "reader_backlog": "Octets read by the reader thread and waiting to be decoded.",
+    "node_loss_ratio": "Fraction of a node's frames lost over the loss window, by sequence (MAC header or TWR).",
+    "node_jitter_seconds": "Inter-arrival jitter of a node's frames.",
+}
+
+def timed_track(update, frame):
+    # call a tracker's update with a frame, timed as the "track" stage when metrics are on
+    m = METRICS
+    if m is None:
+        update(frame)
+        return
+    start = time.perf_counter()
+    update(frame)
+    m.observe("track", time.perf_counter() - start)
+
+def enable():
+    global METRICS
+    if METRICS is None:
+        METRICS = Metrics()
+    return METRICS
+
+def disable():
+    global METRICS
+    METRICS = None
+
+def format_labels(labels):
+    return "" if not labels else "{" + ",".join('{0}="{1}"'.format(name, value) for name, value in labels) + "}"
+
+class Metrics:
+    def __init__(self):
+        self.start = time.time()
+        self.counters = {}  # (name, labels) -> count, labels a tuple of (label, value)
+        self.gauges = {}  # (name, labels) -> value
+        self.timers = {}  # (stage, labels) -> [no. calls, seconds]
+        self.collectors = []  # called with the Metrics before they are served, to set gauges kept up elsewhere
+
+    def add(self, name, count=1, labels=()):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + count
+
+    def set(self, name, value, labels=()):
+        self.gauges[(name, labels)] = value
+
+    def observe(self, stage, seconds, labels=()):
+        timer = self.timers.get((stage, labels))
+        if timer is None:
+            timer = self.timers[(stage, labels)] = [0, 0.0]
+        timer[0] += 1
+        timer[1] += seconds
+
+    def count(self, name):
+        # total of a counter over all its labels
+        return sum(value for (counter, labels), value in self.counters.copy().items() if counter == name)
+
+    def stage_seconds(self):
+        # stage -> seconds spent in it, over all its labels
+        seconds = dict.fromkeys(STAGES, 0.0)
+        for (stage, labels), timer in self.timers.copy().items():
+            seconds[stage] = seconds.get(stage, 0.0) + timer[1]
+        return seconds
+
+    def to_prometheus(self):
+        # all metrics in the Prometheus text exposition format
+        for collect in self.collectors:
+            collect(self)
+        lines = []
+        counters = self.counters.copy()
+        for name, help_text in COUNTERS.items():
+            lines.append("# HELP {0}{1}_total {2}".format(PREFIX, name, help_text))
+            lines.append("# TYPE {0}{1}_total counter".format(PREFIX, name))
+            for (counter, labels), value in sorted(counters.items()):
+                if counter == name:
+                    lines.append("{0}{1}_total{2} {3}".format(PREFIX, name, format_labels(labels), value))
+        gauges = self.gauges.copy()
+        for name, help_text in GAUGES.items():
+            lines.append("# HELP {0}{1} {2}".format(PREFIX, name, help_text))
+            lines.append("# TYPE {0}{1} gauge".format(PREFIX, name))
+            for (gauge, labels), value in sorted(gauges.items()):
+                if gauge == name:
+                    lines.append("{0}{1}{2} {3}".format(PREFIX, name, format_labels(labels), value))
+        lines.append("# HELP {0}stage_seconds Time spent in each pipeline stage, decode by message class.".format(PREFIX))
+        lines.append("# TYPE {0}stage_seconds summary".format(PREFIX))
+        for (stage, labels), (calls, seconds) in sorted(self.timers.copy().items()):
+            labels = format_labels((("stage", stage),) + labels)
+            lines.append("{0}stage_seconds_sum{1} {2:.6f}".format(PREFIX, labels, seconds))
+            lines.append("{0}stage_seconds_count{1} {2}".format(PREFIX, labels, calls))
+        lines.append("# HELP {0}uptime_seconds Time since the metrics were enabled.".format(PREFIX))
+        lines.append("# TYPE {0}uptime_seconds gauge".format(PREFIX))
+        lines.append("{0}uptime_seconds {1:.3f}".format(PREFIX, time.time() - self.start))
+        return "\n".join(lines) + "\n"
+
+    def stats_line(self, last=None):
+        # one line summary: counts, frame rate since the last line (a (time, no. frames) pair) and time per stage
+        now = time.time()
+        frames = self.count("frames")
+        since, last_frames = (self.start, 0) if last is None else last
+        rate = (frames - last_frames) / (now - since) if now > since else 0
+        line = "frames {0} ({1:.0f}/s), malformed {2}, bad FCS {3}, filtered {4}, decode errors {5}, dropped {6}".format(
+            frames, rate, self.count("malformed"), self.count("bad_fcs"), self.count("filtered"), self.count("decode_errors"),
+            self.count("dropped"))
+        gauges = self.gauges.copy()
+        if gauges:
+            line += ", " + ", ".join("{0} {1}".format(name + format_labels(labels), value) for (name, labels), value in sorted(gauges.items()))
+        seconds = self.stage_seconds()
+        stages = " ".join("{0} {1:.3f}s".format(stage, seconds[stage]) for stage in STAGES if seconds[stage])
+        if stages:
+            line += " | " + stages
+        return line, (now, frames)
+
+class InstrumentedWriter:
+    # wraps a frame_output writer, times the decoding of each frame stage by stage before formatting and writing it out
+    # it is the outermost writer, so the wrappers that track frames (capture_file.RecordingWriter, loss_stats.LossWriter)
+    # work on frames already decoded here, in their format() (timed as "track")
+    # (the MAC header fields and message records decoded here are cached by the frame and its messages, so the
+    # record-based writers (jsonl, csv, msgpack) do not decode them again, the text breakdown decodes the fields it prints)
+    def __init__(self, writer, metrics):
+        self.writer = writer
+        self.metrics = metrics
+
+    def write(self, frame):
+        metrics = self.metrics
+        clock = time.perf_counter
+        try:
+            start = clock()
+            frame.macHeader.to_record()
+            header_end = clock()
+            messages = frame.payload.messages
+            dispatch_end = clock()
+            metrics.observe("header", header_end - start)
+            metrics.observe("dispatch", dispatch_end - header_end)
+            for msg in messages:
+                msg_start = clock()
+                msg.to_record()
+                metrics.observe("decode", clock() - msg_start, (("class", type(msg).__name__),))
+                metrics.add("messages", 1, (("msg_id", msg.MSG_ID),))
+            format_start = clock()
+            data = self.writer.format(frame)
+            format_end = clock()
+        except Exception as e:  # corrupt frame: count it, the decode loop reports it and goes on (frame_output.write_frame)
+            metrics.add("decode_errors", 1, (("error", type(e).__name__),))
+            raise
+        self.writer.emit(data)
+        metrics.observe("format", format_end - format_start)
+        metrics.observe("output", clock() - format_end)
+        metrics.add("frames")
+
+    def status(self, message):
+        self.writer.status(message)
+
+def serve(metrics, port, host="127.0.0.1"):
+    # serve the metrics at http://host:port/metrics from a daemon thread, returns the server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.to_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):  # keep stderr for the sniffer's own messages
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+def print_stats(metrics, interval, stream=None, reports=()):
+    # print a stats line every interval seconds from a daemon thread, on stderr by default
+    # reports: functions returning more summary lines, printed after it
+    def run():
+        last = None
+        while True:
+            time.sleep(interval)
+            line, last = metrics.stats_line(last)
+            for report in reports:
+                line += "\n" + report()
+            print(line, file=stream or sys.stderr, flush=True)
+    thread = threading.Thread(target=run, name="metrics-stats", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,139 @@
+import time
+
+import message_payload as mp
+
+# Live view of a DWM1001 network, fed with decoded frames
+# Each frame updates the node that sent it (and the node a join confirmation is for) with a few attribute stores,
+# snapshots are built from a copy of the node index, so reading the state never holds up the frames coming in.
+
+ANCHOR = "anchor"
+TAG = "tag"
+
+class Node:
+    FIELDS = ("address", "role", "firstSeen", "lastSeen", "numFrames", "source", "sessionId", "sfNumber", "clusterSlotNumber",
+              "clusterMap", "dataSlotMap", "clusterSeat", "clusterLock", "nodeId", "hardwareVersion", "firmwareVersion",
+              "anchors", "position")
+    __slots__ = FIELDS
+
+    def __init__(self, address, now):
+        self.address = address  # as in the MAC header (hex)
+        self.role = None  # ANCHOR (sends beacons, responses) or TAG (sends group polls), None until known
+        self.firstSeen = now
+        self.lastSeen = now
+        self.numFrames = 0
+        self.source = None  # sniffer that last received it
+        # beacon (anchors)
+        self.sessionId = None
+        self.sfNumber = None  # superframe number
+        self.clusterSlotNumber = None
+        self.clusterMap = None  # cluster slots heard occupied, bit i for slot i
+        self.dataSlotMap = None
+        # join (seat in the cluster) and identity
+        self.clusterSeat = None
+        self.clusterLock = None
+        self.nodeId = None
+        self.hardwareVersion = None
+        self.firmwareVersion = None
+        # tags: anchors of its last group poll, last position (x, y, z) sent
+        self.anchors = None
+        self.position = None
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+def truncated(msg):
+    # message cut off by the end of the payload, its missing fields decode as None
+    return len(msg.raw) < msg.LENGTH or msg.x is None or msg.y is None or msg.z is None
+
+class NetworkState:
+    def __init__(self):
+        self.nodes = {}  # address -> Node
+        # message class -> method updating the node from it
+        self.handlers = {mp.MsgBeacon: self.beacon, mp.MsgJoinRequest: self.join_request,
+                         mp.MsgJoinConfirmation: self.join_confirmation, mp.MsgAlmanac: self.almanac,
+                         mp.MsgGroupPoll: self.group_poll, mp.MsgPosition: self.position, mp.MsgResponse: self.response}
+
+    def node(self, address, now):
+        node = self.nodes.get(address)
+        if node is None:
+            node = self.nodes[address] = Node(address, now)
+        return node
+
+    def update(self, frame, now=None):
+        # update the state with one FrameData, now is its receive time (frame.timestamp if not given, time.time() if
+        # the frame has none)
+        header = frame.macHeader
+        if header.srcAddr is None:
+            return
+        if now is None:
+            now = time.time() if frame.timestamp is None else frame.timestamp
+        node = self.node(header.srcAddr.get_data(), now)
+        node.lastSeen = now
+        node.numFrames += 1
+        node.source = frame.source
+        for msg in frame.payload.messages:
+            handler = self.handlers.get(type(msg))
+            if handler is not None:
+                handler(node, msg, now)
+
+    def beacon(self, node, msg, now):
+        node.role = ANCHOR
+        node.sessionId = msg.sessionId.octets
+        node.sfNumber = msg.sfNumber.octets
+        node.clusterSlotNumber = msg.clusterSlotNumber.octets
+        node.clusterMap = msg.clusterMap.octets
+        node.dataSlotMap = msg.dataSlotMap.octets
+
+    def join_request(self, node, msg, now):
+        node.hardwareVersion = msg.hardwareVersion.get_data()
+        node.firmwareVersion = msg.firmwareVersion.get_data()
+
+    def join_confirmation(self, node, msg, now):
+        # sent to the joining node, whose seat it gives
+        joined = self.node(msg.address.get_data(), now)
+        joined.clusterSeat = msg.clusterSeat.octets
+        joined.clusterLock = msg.clusterLock.octets
+
+    def almanac(self, node, msg, now):
+        node.nodeId = msg.nodeId.get_data()
+        node.hardwareVersion = msg.hardwareVersion.get_data()
+        node.firmwareVersion = msg.firmwareVersion.get_data()
+
+    def group_poll(self, node, msg, now):
+        node.role = TAG
+        if truncated(msg):
+            return
+        node.anchors = tuple(address.get_data() for address in (msg.address0, msg.address1, msg.address2, msg.address3)
+                             if address.octets not in (0x0000, 0xffff))  # unused slots
+        node.position = (msg.x.value, msg.y.value, msg.z.value)
+
+    def position(self, node, msg, now):
+        if truncated(msg):
+            return
+        node.position = (msg.x.value, msg.y.value, msg.z.value)
+
+    def response(self, node, msg, now):
+        node.role = ANCHOR
+
+    def snapshot(self, max_age=None, now=None):
+        # address -> node dict, of the nodes seen in the last max_age seconds (all if None)
+        # the index is copied in one step (atomic under the GIL), each node is then read without stopping updates
+        nodes = self.nodes.copy()
+        if max_age is not None:
+            oldest = (time.time() if now is None else now) - max_age
+            return {address: node.to_dict() for address, node in nodes.items() if node.lastSeen >= oldest}
+        return {address: node.to_dict() for address, node in nodes.items()}
+
+    def anchors(self):
+        return [node.to_dict() for node in self.nodes.copy().values() if node.role == ANCHOR]
+
+    def tags(self):
+        return [node.to_dict() for node in self.nodes.copy().values() if node.role == TAG]
+
+    def cluster_slots(self):
+        # cluster slot number -> addresses of the anchors beaconing in it (more than one is a slot conflict)
+        slots = {}
+        for node in self.nodes.copy().values():
+            if node.role == ANCHOR and node.clusterSlotNumber is not None:
+                slots.setdefault(node.clusterSlotNumber, []).append(node.address)
+        return slots
@@ -0,0 +1,123 @@
+import numpy as np
+
+import frame_data as fd
+import message_payload as mp
+
+# output columns, frameIndex is the position of the frame in the input
+POSITION_DTYPE = np.dtype([("frameIndex", "<i8"), ("srcAddr", "<u8"), ("sequenceNumber", "u1"),
+                           ("x", "<f4"), ("y", "<f4"), ("z", "<f4")])
+GROUP_POLL_DTYPE = np.dtype([("frameIndex", "<i8"), ("srcAddr", "<u8"), ("sequenceNumber", "u1"),
+                             ("x", "<f4"), ("y", "<f4"), ("z", "<f4"),
+                             ("qualityFactor", "i1"), ("stationaryFlag", "?")])
+
+# columns read from each message, as (offset in the message, format)
+POSITION_FIELDS = {"x": (1, "<f4"), "y": (5, "<f4"), "z": (9, "<f4")}
+GROUP_POLL_FIELDS = {"statflagQfactor": (14, "u1"), "x": (15, "<f4"), "y": (19, "<f4"), "z": (23, "<f4")}
+
+MSG_IDS = np.array([int(mp.MsgPosition.MSG_ID, 16), int(mp.MsgGroupPoll.MSG_ID, 16)], dtype=np.uint8)
+
+def frame_layout(frame_len, layout, msg_start, msg_fields):
+    # structured dtype over a whole frame, reading the header and message fields at fixed offsets
+    names = ["srcAddr", "sequenceNumber"]
+    formats = ["<u2" if layout.srcAddrOctets == 2 else "<u8", "u1"]
+    offsets = [layout.srcAddr_idx, 2]
+    for name, (offset, fmt) in msg_fields.items():
+        names.append(name)
+        formats.append(fmt)
+        offsets.append(msg_start + offset)
+    return np.dtype({"names": names, "formats": formats, "offsets": offsets, "itemsize": frame_len})
+
+def fill_columns(out, rows, index, msg_fields):
+    out["frameIndex"] = index
+    out["srcAddr"] = rows["srcAddr"]
+    out["sequenceNumber"] = rows["sequenceNumber"]
+    for name in ("x", "y", "z"):
+        out[name] = rows[name]
+    if "statflagQfactor" in msg_fields:
+        # same decoding as MsgGroupPoll: stationary flag is bit 0, the quality factor is (for now) the signed octet
+        octet = rows["statflagQfactor"]
+        out["qualityFactor"] = octet.view(np.int8)
+        out["stationaryFlag"] = (octet & 1) != 0
+
+def decode_group(frames, index, positions, group_polls, fallback):
+    # frames share FC and length, hence the same header layout and message offsets
+    frame_len = len(frames[0])
+    layout = fd.header_layout(frames[0][0] | frames[0][1] << 8)  # FC
+    if layout.srcAddr_idx is None:  # no source address to report
+        return
+    msg_start = layout.length
+    payload_stop = frame_len - 2  # excluding FCS
+    if msg_start >= payload_stop:
+        return
+    buf = b"".join(frames)
+    octets = np.frombuffer(buf, dtype=np.uint8).reshape(len(frames), frame_len)
+    msg_ids = octets[:, msg_start]
+    index = np.asarray(index, dtype=np.int64)
+    handled = np.zeros(len(frames), dtype=bool)
+    for msgType, msg_fields, dtype, results in ((mp.MsgPosition, POSITION_FIELDS, POSITION_DTYPE, positions),
+                                               (mp.MsgGroupPoll, GROUP_POLL_FIELDS, GROUP_POLL_DTYPE, group_polls)):
+        msg_stop = msg_start + msgType.LENGTH
+        if msg_stop > payload_stop:  # message does not fit in these frames
+            continue
+        match = msg_ids == int(msgType.MSG_ID, 16)
+        # another message after this one needs the full walk through the payload
+        if msg_stop < payload_stop:
+            match &= ~np.isin(octets[:, msg_stop:payload_stop], MSG_IDS).any(axis=1)
+        if not match.any():
+            continue
+        rows = np.frombuffer(buf, dtype=frame_layout(frame_len, layout, msg_start, msg_fields))[match]
+        out = np.empty(len(rows), dtype=dtype)
+        fill_columns(out, rows, index[match], msg_fields)
+        results.append(out)
+        handled |= match
+    # frames with a position message later in the payload (e.g. after a beacon) are decoded one by one
+    maybe = ~handled & np.isin(octets[:, msg_start:payload_stop], MSG_IDS).any(axis=1)
+    for i in np.flatnonzero(maybe):
+        fallback.append((index[i], frames[i]))
+
+def decode_fallback(fallback, positions, group_polls):
+    position_rows = []
+    group_poll_rows = []
+    for i, raw in fallback:
+        frame = fd.FrameData(raw)
+        srcAddr = int(frame.macHeader.srcAddr.get_data(), 16)
+        sequenceNumber = int(frame.macHeader.sequenceNumber.get_data(), 16)
+        for msg in frame.payload.messages:
+            if isinstance(msg, mp.MsgPosition):
+                if len(msg.raw) < msg.LENGTH:  # truncated, coordinates missing
+                    continue
+                position_rows.append((i, srcAddr, sequenceNumber, msg.x.value, msg.y.value, msg.z.value))
+            elif isinstance(msg, mp.MsgGroupPoll):
+                if len(msg.raw) < msg.LENGTH:
+                    continue
+                group_poll_rows.append((i, srcAddr, sequenceNumber, msg.x.value, msg.y.value, msg.z.value,
+                                        msg.qualityFactor.value, msg.stationaryFlag.value))
+    positions.append(np.array(position_rows, dtype=POSITION_DTYPE))
+    group_polls.append(np.array(group_poll_rows, dtype=GROUP_POLL_DTYPE))
+
+def merge(results, dtype):
+    if not results:
+        return np.empty(0, dtype=dtype)
+    merged = np.concatenate(results)
+    return merged[np.argsort(merged["frameIndex"], kind="stable")]
+
+def decode_positions(frames):
+    # decode MsgPosition and MsgGroupPoll coordinates of many raw frames (bytes) into structured arrays,
+    # returns (positions, group polls) in input order
+    # frames with the same FC and length share all offsets, so each such group is decoded with one
+    # np.frombuffer over its concatenated frames instead of one Python object per field
+    groups = {}  # (FC octets, frame length) -> (frames, frame indexes)
+    for i, raw in enumerate(frames):
+        if len(raw) < 5:  # shorter than FC, sequence number and FCS
+            continue
+        group = groups.setdefault((raw[0], raw[1], len(raw)), ([], []))
+        group[0].append(raw)
+        group[1].append(i)
+    positions = []
+    group_polls = []
+    fallback = []
+    for group_frames, index in groups.values():
+        decode_group(group_frames, index, positions, group_polls, fallback)
+    if fallback:
+        decode_fallback(fallback, positions, group_polls)
+    return merge(positions, POSITION_DTYPE), merge(group_polls, GROUP_POLL_DTYPE)
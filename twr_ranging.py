@@ -0,0 +1,110 @@
+from collections import deque
+
+import message_payload as mp
+
+# Passive two-way ranging (TWR) tracker
+# A tag sends a Group Poll (GP) to up to 4 anchors, each anchor replies with a Response carrying its GP RX and
+# Response TX timestamps. The engine matches the responses to their group poll as frames arrive and keeps the
+# last exchanges of each tag in a ring buffer, so memory does not grow over a long run.
+
+SPEED_OF_LIGHT = 299702547  # m/s, in air
+HISTORY = 16  # exchanges kept per tag
+NO_ANCHOR = (0x0000, 0xffff)  # unused anchor address slots of a group poll
+RESPONSE_TIMESTAMP_BITS = 32  # MsgResponse carries the lower 32 bits of the DW1000 timestamps
+
+def tick_interval(start, stop, bits=mp.DW1000_TIMESTAMP_BITS):
+    # DW1000 ticks from start to stop, across a wrap of the counter (of the given no. bits)
+    return (stop - start) % (1 << bits)
+
+def ss_twr_distance(round_trip, reply):
+    # single-sided TWR distance (m): time of flight is half of the round trip at the tag minus the reply time of the anchor (ticks)
+    return (round_trip - reply) / 2 * mp.DW1000_TICK * SPEED_OF_LIGHT
+
+class TwrExchange:
+    # one group poll of a tag and the responses of its anchors
+    __slots__ = ("tag", "sequenceNumber", "anchors", "replies", "source")
+
+    def __init__(self, tag, sequenceNumber, anchors, source=None):
+        self.tag = tag  # address (int)
+        self.sequenceNumber = sequenceNumber  # TWR sequence number of the group poll
+        self.anchors = anchors  # addresses (int) polled, in slot order
+        self.replies = {}  # anchor -> (GP RX timestamp, Response TX timestamp) in ticks
+        self.source = source  # sniffer the group poll was received from
+
+    def is_complete(self):
+        return len(self.replies) == len(self.anchors)
+
+    def reply_times(self):
+        # anchor -> time (ticks) between receiving the group poll and sending its response
+        return {anchor: tick_interval(gp_rx, r_tx, RESPONSE_TIMESTAMP_BITS) for anchor, (gp_rx, r_tx) in self.replies.items()}
+
+    def ranges(self, round_trips):
+        # anchor -> distance (m), given the round trip time (ticks) measured by the tag for each anchor
+        # (GP TX to Response RX: the tag's timestamps are not sent over the air, so a passive sniffer cannot see them)
+        reply_times = self.reply_times()
+        return {anchor: ss_twr_distance(round_trips[anchor], reply) for anchor, reply in reply_times.items() if anchor in round_trips}
+
+    def to_dict(self):
+        return {"tag": self.tag, "sequenceNumber": self.sequenceNumber, "anchors": list(self.anchors),
+                "replyTimes": self.reply_times(), "complete": self.is_complete(), "source": self.source}
+
+class TwrEngine:
+    def __init__(self, history=HISTORY):
+        self.history = history
+        self.pending = {}  # tag -> exchange waiting for responses
+        self.anchorExchange = {}  # anchor -> pending exchange it was last polled in
+        self.exchanges = {}  # tag -> ring buffer (deque) of its last finished exchanges, oldest first
+
+    def update(self, frame):
+        # process one FrameData, returns the exchanges it finished (usually none)
+        finished = []
+        header = frame.macHeader
+        if header.srcAddr is None:
+            return finished
+        for msg in frame.payload.messages:
+            if isinstance(msg, mp.MsgGroupPoll):
+                self.group_poll(header.srcAddr.octets, msg, frame.source, finished)
+            elif isinstance(msg, mp.MsgResponse):
+                dest = None if header.destAddr is None else header.destAddr.octets
+                self.response(header.srcAddr.octets, dest, msg, finished)
+        return finished
+
+    def group_poll(self, tag, msg, source, finished):
+        sequenceNumber = msg.sequenceNumber.octets
+        exchange = self.pending.get(tag)
+        if exchange is not None:
+            if exchange.sequenceNumber == sequenceNumber:  # same poll heard again (e.g. by another sniffer)
+                return
+            self.finish(exchange, finished)  # the tag moved on, keep what was received
+        anchors = tuple(address.octets for address in (msg.address0, msg.address1, msg.address2, msg.address3)
+                        if address.octets not in NO_ANCHOR)
+        exchange = self.pending[tag] = TwrExchange(tag, sequenceNumber, anchors, source)
+        for anchor in anchors:
+            self.anchorExchange[anchor] = exchange
+
+    def response(self, anchor, dest, msg, finished):
+        # responses are matched to the poll of the tag they are sent to, or (broadcast) to the last poll of the anchor
+        exchange = self.pending.get(dest)
+        if exchange is None or anchor not in exchange.anchors:
+            exchange = self.anchorExchange.get(anchor)
+            if exchange is None:  # poll not received
+                return
+        exchange.replies[anchor] = (msg.gpTimestamp.ticks, msg.rTimestamp.ticks)
+        if exchange.is_complete():
+            self.finish(exchange, finished)
+
+    def finish(self, exchange, finished):
+        if self.pending.get(exchange.tag) is exchange:
+            del self.pending[exchange.tag]
+        for anchor in exchange.anchors:
+            if self.anchorExchange.get(anchor) is exchange:
+                del self.anchorExchange[anchor]
+        ring = self.exchanges.get(exchange.tag)
+        if ring is None:
+            ring = self.exchanges[exchange.tag] = deque(maxlen=self.history)
+        ring.append(exchange)
+        finished.append(exchange)
+
+    def last_exchanges(self, tag):
+        # finished exchanges of a tag, oldest first
+        return list(self.exchanges.get(tag, ()))
@@ -1,38 +1,229 @@
 import argparse
-import serial
+import asyncio
+import os
+import sys
+import time
 
+import capture_file as cf
 import frame_data as fd
+import frame_filter as ff
+import frame_ingest as fi
+import frame_output as fo
+import frame_reader as fr
+import loss_stats as ls
+import message_payload as mp
+import metrics
+
+def sniff(port, baud_rate, timeout, output, fcs_check=None, frame_filter=None, ring_size=None):
+    import serial  # only needed for a live sniffer, replays work without pyserial
+    # Connect to Serial port
+    ser = serial.Serial(port, baud_rate, timeout=timeout)
+    # With a ring size, the port is read by its own thread (pipeline), the frames are decoded in this one
+    source = ser if ring_size == None else fr.ReaderThread(ser, capacity=ring_size).start()
+
+    # Continuously read frame data until program is stopped
+    def on_timeout():
+        output.status("No data received; serial timeout")
+    def on_error(line):
+        output.status("Malformed frame: {}".format(line))
+    num_bad_fcs = 0
+    def on_bad_fcs(raw):
+        nonlocal num_bad_fcs
+        num_bad_fcs += 1
+        output.status("FCS mismatch ({0} so far): {1}".format(num_bad_fcs, raw.hex()))
+    try:
+        for frame in fr.iter_frames(source, on_timeout=on_timeout, on_error=on_error, fcs_check=fcs_check, on_bad_fcs=on_bad_fcs, frame_filter=frame_filter, name=port):
+            fo.write_frame(output, frame)
+    finally:
+        if source is not ser:
+            print(source.to_string(), file=sys.stderr)
+
+def sniff_many(urls, baud_rate, output, fcs_check=None, frame_filter=None):
+    # Read several sniffers (serial ports or TCP serial bridges) in one event loop
+    def on_error(source, line):
+        output.status("Malformed frame from {0}: {1}".format(source, line))
+    num_bad_fcs = {url: 0 for url in urls}  # per sniffer, as a link quality metric
+    def on_bad_fcs(source, raw):
+        num_bad_fcs[source] += 1
+        output.status("FCS mismatch from {0} ({1} so far): {2}".format(source, num_bad_fcs[source], raw.hex()))
+
+    async def run():
+        queue = asyncio.Queue(fi.QUEUE_SIZE)
+        m = metrics.METRICS
+        async def consume():
+            while True:
+                frame = await queue.get()
+                if m is not None:
+                    m.set("queue_depth", queue.qsize())
+                fo.write_frame(output, frame)
+        consumer = asyncio.create_task(consume())
+        try:
+            await fi.ingest(urls, queue, baud_rate, on_error, fcs_check, on_bad_fcs, frame_filter)
+        finally:
+            consumer.cancel()
+        while not queue.empty():  # frames left once every sniffer is closed
+            fo.write_frame(output, queue.get_nowait())
+    asyncio.run(run())
+
+def replay(path, output, baud_rate=None, fcs_check=None, frame_filter=None, since=None, until=None):
+    # Decode a raw capture (the hex lines sent by the sniffer, or a binary capture) as fast as possible,
+    # or paced at the serial line rate when a baud rate is given
+    # since/until (s since the epoch) select the frames of a binary capture by receive time
+    octet_time = 0 if (baud_rate == None) else 10 / baud_rate  # 8N1: 10 bits on the line per octet
+    num_frames = 0
+    line_octets = 0
+    num_bad_fcs = 0
+    def on_error(line):
+        output.status("Malformed frame: {}".format(line))
+    def on_bad_fcs(raw):
+        nonlocal num_bad_fcs
+        num_bad_fcs += 1
+    start = time.perf_counter()
+    try:
+        with open(path, "rb") as capture:
+            binary = cf.is_capture(path)
+            if binary:  # only the frames its index selects are read, with the time they were received
+                frames = cf.iter_frames(path, since, until, on_error=on_error, fcs_check=fcs_check, on_bad_fcs=on_bad_fcs, frame_filter=frame_filter)
+            else:
+                frames = fr.iter_frames(capture, on_error=on_error, fcs_check=fcs_check, on_bad_fcs=on_bad_fcs, frame_filter=frame_filter)
+            for frame in frames:
+                if octet_time:  # the frame is received once its line is through
+                    line_octets += 2*len(frame.raw) + 2  # hex characters and line ending
+                    delay = start + line_octets*octet_time - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                if not binary:  # a text capture has no receive times, paced frames are received as they are replayed
+                    frame.timestamp = time.time() if octet_time else None
+                fo.write_frame(output, frame)
+                num_frames += 1
+    finally:
+        # report on stderr, stdout only carries the decoded frames
+        elapsed = time.perf_counter() - start
+        rate = num_frames / elapsed if elapsed > 0 else 0
+        print("Replayed {0} frames in {1:.3f} s ({2:.0f} frames/s)".format(num_frames, elapsed, rate), file=sys.stderr)
+        if fcs_check != None:
+            print("{0} frames with an FCS mismatch ({1})".format(num_bad_fcs, "dropped" if fcs_check == "drop" else "flagged"), file=sys.stderr)
+        if mp.MessagePayload.cache != None:
+            print(mp.MessagePayload.cache.to_string(), file=sys.stderr)
+        if metrics.METRICS != None:
+            print(metrics.METRICS.stats_line()[0], file=sys.stderr)
 
 def main():
     parser = argparse.ArgumentParser(description=__doc__)
-    parser.add_argument('-p', '--serial-port',
-                        help='Serial port to connect to.', required=True)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('-p', '--serial-port', action='append',
+                        help='Serial port to connect to, or tcp://HOST:PORT for a TCP serial bridge. Repeat to read several sniffers at once.')
+    source.add_argument('--replay', metavar='FILE',
+                        help='Decode a raw capture of the sniffer output instead of a serial port.')
     parser.add_argument('-b', '--baud-rate',
                         help='Baud rate (DWM1001 sniffer application uses 115200).', required=False)
     parser.add_argument('-t', '--timeout',
-                        help='readline timeout in seconds (default is 3.0).', required=False)
+                        help='read timeout in seconds (default is 3.0).', required=False)
+    parser.add_argument('--realtime', action='store_true',
+                        help='Pace --replay at the serial line rate of the baud rate instead of decoding at full speed.')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='Read the serial port from its own thread, so bursts are drained while frames are decoded. Overruns are counted.')
+    parser.add_argument('--ring-size', type=int, default=fr.RING_CAPACITY, metavar='OCTETS',
+                        help='With --pipeline, max. no. octets read and waiting to be decoded (default is {}).'.format(fr.RING_CAPACITY))
+    parser.add_argument('--capture', metavar='FILE',
+                        help='Also save the frames decoded to a binary capture, indexed by receive time and source address (FILE.idx).')
+    parser.add_argument('--since', type=float, metavar='TIME',
+                        help='With --replay of a binary capture, only the frames received from TIME (seconds since the epoch).')
+    parser.add_argument('--until', type=float, metavar='TIME',
+                        help='With --replay of a binary capture, only the frames received before TIME (seconds since the epoch).')
+    parser.add_argument('-f', '--format', choices=sorted(fo.WRITERS), default='text',
+                        help='Output format (default is text). msgpack needs the msgpack package.')
+    parser.add_argument('--payload-cache', type=int, metavar='SIZE',
+                        help='Reuse the decoded messages of the last SIZE distinct payloads for frames that repeat them.')
+    parser.add_argument('--src', action='append', metavar='ADDR',
+                        help='Only decode frames from this source address (hex, as printed). Repeat for several.')
+    parser.add_argument('--dest', action='append', metavar='ADDR',
+                        help='Only decode frames to this destination address (hex). Repeat for several.')
+    parser.add_argument('--pan-id', action='append', metavar='PANID',
+                        help='Only decode frames of this PAN ID (hex). Repeat for several.')
+    parser.add_argument('--frame-type', action='append', choices=fd.FrameType.FRAME_TYPES[:4],
+                        help='Only decode frames of this type. Repeat for several.')
+    parser.add_argument('--msg-id', action='append', metavar='ID',
+                        help='Only decode frames with a message of this ID (hex, e.g. 18 for positions). Repeat for several.')
+    parser.add_argument('--fcs', choices=fr.FCS_CHECKS,
+                        help='Verify the FCS of each frame before decoding it: flag the frames that fail, or drop them. Failures are counted.')
+    parser.add_argument('--buffer', type=int, metavar='SIZE',
+                        help='Write the output from a thread, in batches, with up to SIZE frames queued, so reading never waits on the output.')
+    parser.add_argument('--when-full', choices=fo.WHEN_FULL, default='block',
+                        help='With --buffer, when the queue is full: wait for room, or drop the frame (counted). Default is block.')
+    parser.add_argument('--flush-interval', type=float, default=fo.FLUSH_INTERVAL, metavar='SECONDS',
+                        help='With --buffer, max. time a frame waits for its batch to be written (default is {}).'.format(fo.FLUSH_INTERVAL))
+    parser.add_argument('--metrics-port', type=int, metavar='PORT',
+                        help='Serve counters and stage timings in the Prometheus text format at http://127.0.0.1:PORT/metrics.')
+    parser.add_argument('--stats-interval', type=float, metavar='SECONDS',
+                        help='Print a line of counters and stage timings on stderr every SECONDS.')
+    parser.add_argument('--loss-stats', action='store_true',
+                        help='Track sequence gaps (frames lost) per node, summarized with --stats-interval and on exit.')
     options = parser.parse_args()
+    if options.pipeline and (options.replay != None or len(options.serial_port) > 1 or options.serial_port[0].startswith("tcp://")):
+        parser.error("--pipeline reads a single serial port, it cannot be used with --replay, several -p or tcp:// sources")
+    for option, values in (("--src", options.src), ("--dest", options.dest), ("--pan-id", options.pan_id)):
+        not_hex = [value for value in values or () if not ff.is_hex(value)]
+        if not_hex:
+            parser.error("%s %s: not a hex value" % (option, ", ".join(not_hex)))
+    unknown_msg_ids = [msg_id for msg_id in options.msg_id or () if not ff.known_msg_id(msg_id)]
+    if unknown_msg_ids:
+        parser.error("--msg-id %s: not a message ID the decoder walks payloads for (%s)"
+                     % (", ".join(unknown_msg_ids), ", ".join("%02x" % msg_id for msg_id in sorted(mp.MSG_DECODERS))))
+    if options.capture != None and options.replay != None and not options.realtime and os.path.isfile(options.replay) and not cf.is_capture(options.replay):
+        parser.error("a text capture has no receive times: --capture with its --replay needs --realtime, to record the time each frame is replayed")
 
     # Parse options
-    baud_rate = 115200 if (options.baud_rate == None) else options.baud_rate
+    baud_rate = 115200 if (options.baud_rate == None) else int(options.baud_rate)
     timeout = 3.0 if (options.timeout == None) else float(options.timeout)
-    # Connect to Serial port
-    ser = serial.Serial(options.serial_port, baud_rate, timeout=timeout)
 
-    # Continuously read frame data until program is stopped
-    while True:
-        line = ser.readline()
-        if len(line) == 0:
-            print("No data received; serial timeout")
-            continue
-        #print(line.decode("utf-8"))
-        # print(line)
-
-        # Decode frame
-        line = str(line)[2:len(line)]
-        frame = fd.FrameData(line)  # TODO: line.decode("utf-8") produces one extra byte at the end
-        print(frame.data_breakdown(0))
-        print("---------------------")
+    output = fo.WRITERS[options.format]()
+    frame_filter = None
+    if options.src or options.dest or options.pan_id or options.frame_type or options.msg_id:
+        frame_filter = ff.FrameFilter(options.src, options.dest, options.pan_id, options.frame_type, options.msg_id)
+    if options.payload_cache != None:
+        mp.MessagePayload.cache = mp.PayloadCache(options.payload_cache)
+    loss = ls.LossTracker() if options.loss_stats else None
+    if options.metrics_port != None or options.stats_interval != None:
+        # enabled before reading, the pipeline checks for metrics once per source
+        m = metrics.enable()
+        if loss != None:
+            m.collectors.append(loss.publish)
+        if options.metrics_port != None:
+            metrics.serve(m, options.metrics_port)
+        if options.stats_interval != None:
+            metrics.print_stats(m, options.stats_interval, reports=() if loss == None else (loss.to_string,))
+    buffered = None
+    if options.buffer != None:
+        output = buffered = fo.BufferedWriter(output, options.buffer, options.when_full, flush_interval=options.flush_interval)
+    capture = None
+    if options.capture != None:
+        capture = cf.CaptureWriter(options.capture)
+        output = cf.RecordingWriter(output, capture)
+    if loss != None:
+        output = ls.LossWriter(output, loss)
+    if metrics.METRICS != None:  # outermost, so the frames are decoded in its timed stages
+        output = metrics.InstrumentedWriter(output, metrics.METRICS)
+
+    try:
+        if options.replay != None:
+            replay(options.replay, output, baud_rate if options.realtime else None, options.fcs, frame_filter, options.since, options.until)
+        elif len(options.serial_port) == 1 and not options.serial_port[0].startswith("tcp://"):
+            sniff(options.serial_port[0], baud_rate, timeout, output, options.fcs, frame_filter,
+                  options.ring_size if options.pipeline else None)
+        else:
+            sniff_many(options.serial_port, baud_rate, output, options.fcs, frame_filter)
+    finally:
+        if capture != None:
+            capture.close()  # writes its index
+        if buffered != None:
+            buffered.close()  # write out what is still queued
+            if buffered.dropped:
+                print("{} frames dropped, the output could not keep up".format(buffered.dropped), file=sys.stderr)
+            if buffered.droppedStatus:
+                print("{} status messages dropped, the output could not keep up".format(buffered.droppedStatus), file=sys.stderr)
+        if loss != None:
+            print(loss.to_string(), file=sys.stderr)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()